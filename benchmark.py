@@ -0,0 +1,228 @@
+"""
+合成データによる create_schedule のベンチマーク
+
+input.xlsx と同じレイアウト（start/end/past マーカー、曜日行、日付行、昼/夜行）の
+Excelファイルを人数・日数・×の密度・輪番の数を変えて生成し、
+読み込み・モデル作成・求解・Excel書き出しの所要時間と目的関数値をCSV/JSONで出力する。
+--horizon-check を指定すると、期間分割モードの結果がまとめて解いた結果と同じかを確認する（回帰確認）。
+
+使い方:
+    python benchmark.py --people 20 40 --days 31 62 --ng-density 0.3 0.6 --rinban 0 5 --time-limit 30
+    python benchmark.py --horizon-check input.xlsx --horizon-days 14 21 28
+"""
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import openpyxl
+
+import dutyAssign
+from dutyAssign import (
+    COL_NAMES, COL_REQUIRED_SHIFTS, MARKER_DATE_END, MARKER_DATE_PAST, MARKER_DATE_START,
+    MARKER_PERSON_END, MARKER_PERSON_START, ROW_DATE, ROW_MARKERS, ROW_SHIFT_TYPE, ROW_WEEKDAY,
+)
+
+WEEKDAY_NAMES = ["月", "火", "水", "木", "金", "土", "日"]
+FIRST_DATA_COL = 2  # 前月データ（past）が始まる列
+FIRST_PERSON_ROW = ROW_SHIFT_TYPE + 1  # 名前の 'start' マーカーは昼/夜行に置く
+
+# 結果ファイルの列
+RESULT_FIELDS = [
+    "people", "days", "ng_density", "maru_density", "num_rinban", "seed",
+    "parse_seconds", "build_seconds", "solve_seconds", "write_seconds", "total_seconds",
+    "num_variables", "num_constraints", "status", "num_people_assigned", "preference_score",
+]
+# 期間分割モードの確認結果の列（horizon_daysが空の行は、まとめて解いた結果）
+HORIZON_CHECK_FIELDS = [
+    "file", "horizon_days", "horizon_step", "status", "num_people_assigned", "preference_score",
+    "total_seconds", "match",
+]
+
+def calendar_columns(start_date, num_days):
+    """日ごとの列を (日付, 曜日, 勤務タイプ) のリストで返す。土日は昼・夜の2列、平日は1列"""
+    columns = []
+    for k in range(num_days):
+        date = start_date + datetime.timedelta(days=k)
+        weekday = WEEKDAY_NAMES[date.weekday()]
+        if weekday in ("土", "日"):
+            columns.append((date, weekday, "昼"))
+            columns.append((date, weekday, "夜"))
+        else:
+            columns.append((date, weekday, None))
+    return columns
+
+def generate_workbook(path, num_people, num_days, ng_density, num_rinban,
+                      maru_density=0.05, past_days=7, start_date=datetime.date(2025, 10, 1), seed=0):
+    """合成の勤務希望Excelファイルを作成する
+
+    必要勤務回数は木曜以外の列数を人数で割り振り、×・〇・輪番は乱数で配置する。
+    前月データ（past_days日分）には、各列に1人ずつ〇（勤務実績）を置く。
+    """
+    rng = np.random.default_rng(seed)
+    past_columns = calendar_columns(start_date - datetime.timedelta(days=past_days), past_days)
+    month_columns = calendar_columns(start_date, num_days)
+    start_col = FIRST_DATA_COL + len(past_columns)
+    end_col = start_col + len(month_columns)  # この列は含まない
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+
+    def put(row, col, value):
+        ws.cell(row=row + 1, column=col + 1, value=value)
+
+    # ヘッダー行
+    put(ROW_MARKERS, FIRST_DATA_COL, MARKER_DATE_PAST)
+    put(ROW_MARKERS, start_col, MARKER_DATE_START)
+    put(ROW_MARKERS, end_col - 1, MARKER_DATE_END)
+    put(ROW_DATE, COL_REQUIRED_SHIFTS, "仮当直数")
+    put(ROW_SHIFT_TYPE, COL_NAMES, MARKER_PERSON_START)
+    for offset, (date, weekday, shift_type) in enumerate(past_columns + month_columns):
+        col = FIRST_DATA_COL + offset
+        put(ROW_WEEKDAY, col, weekday)
+        put(ROW_DATE, col, date.day)
+        if shift_type is not None:
+            put(ROW_SHIFT_TYPE, col, shift_type)
+
+    # 必要勤務回数: 木曜以外の列には必ず1人必要
+    num_required = sum(1 for _, weekday, _ in month_columns if weekday != "木")
+    required = np.full(num_people, num_required // num_people)
+    required[:num_required % num_people] += 1
+
+    # 勤務希望
+    prefs = np.full((num_people, len(month_columns)), None, dtype=object)
+    draw = rng.random(prefs.shape)
+    prefs[draw < ng_density] = "×"
+    prefs[(draw >= ng_density) & (draw < ng_density + maru_density)] = "〇"
+    night_offsets = [k for k, (_, _, shift_type) in enumerate(month_columns) if shift_type != "昼"]
+    for _ in range(num_rinban):
+        prefs[rng.integers(num_people), rng.choice(night_offsets)] = "輪番"
+
+    for p in range(num_people):
+        row = FIRST_PERSON_ROW + p
+        put(row, COL_REQUIRED_SHIFTS, int(required[p]))
+        put(row, COL_NAMES, f"職員{p + 1:03d}")
+        for k, value in enumerate(prefs[p]):
+            if value is not None:
+                put(row, start_col + k, value)
+    # 前月の勤務実績
+    for k in range(len(past_columns)):
+        put(FIRST_PERSON_ROW + int(rng.integers(num_people)), FIRST_DATA_COL + k, "〇")
+    put(FIRST_PERSON_ROW + num_people, COL_NAMES, MARKER_PERSON_END)
+
+    wb.save(path)
+    return path
+
+def run_benchmark(people_grid, days_grid, ng_density_grid, rinban_grid, seeds, time_limit, work_dir,
+                  maru_density_grid=(0.05,), num_workers=None):
+    """サイズのグリッド全体で create_schedule を実行し、結果のdictのリストを返す"""
+    results = []
+    for num_people, num_days, ng_density, maru_density, num_rinban, seed in itertools.product(
+            people_grid, days_grid, ng_density_grid, maru_density_grid, rinban_grid, seeds):
+        path = os.path.join(work_dir, f"bench_p{num_people}_d{num_days}_ng{ng_density}_maru{maru_density}"
+                                      f"_r{num_rinban}_s{seed}.xlsx")
+        generate_workbook(path, num_people, num_days, ng_density, num_rinban, maru_density=maru_density, seed=seed)
+        stats = {}
+        start = time.perf_counter()
+        # 毎回求解の時間を測るため、解のキャッシュは使わない
+        dutyAssign.create_schedule(path, time_limit=time_limit, stats=stats, use_cache=False, num_workers=num_workers)
+        row = {
+            "people": num_people, "days": num_days, "ng_density": ng_density, "maru_density": maru_density,
+            "num_rinban": num_rinban, "seed": seed,
+            "total_seconds": time.perf_counter() - start,
+        }
+        row.update({key: stats.get(key) for key in RESULT_FIELDS if key in stats})
+        results.append(row)
+        print(json.dumps(row, ensure_ascii=False), flush=True)
+    return results
+
+def check_horizon(files, horizon_days_grid, horizon_step, time_limit, work_dir, num_workers=None):
+    """各ファイルをまとめて解いた結果と、区間の日数ごとの期間分割モードの結果を比べ、結果のdictのリストを返す
+
+    期間分割モードの行の match は、〇を採用した人数と〇の採用スコアがまとめて解いた結果と同じならTrue。
+    出力ファイルが入力ファイルの隣に作られないよう、入力ファイルは work_dir にコピーしてから解く。
+    """
+    results = []
+    for file_path in files:
+        path = os.path.join(work_dir, os.path.basename(file_path))
+        shutil.copy(file_path, path)
+        expected = None
+        for horizon_days in [None] + list(horizon_days_grid):
+            stats = {}
+            start = time.perf_counter()
+            dutyAssign.create_schedule(path, time_limit=time_limit, stats=stats, use_cache=False, num_workers=num_workers,
+                                       horizon_days=horizon_days, horizon_step=horizon_step)
+            score = (stats.get("num_people_assigned"), stats.get("preference_score"))
+            if horizon_days is None:
+                expected = score
+            row = {
+                "file": file_path, "horizon_days": horizon_days, "horizon_step": horizon_step if horizon_days else None,
+                "status": stats.get("status"), "num_people_assigned": score[0], "preference_score": score[1],
+                "total_seconds": time.perf_counter() - start,
+                "match": None if horizon_days is None else score == expected,
+            }
+            results.append(row)
+            print(json.dumps(row, ensure_ascii=False), flush=True)
+    return results
+
+def write_results(results, output_prefix, fields=RESULT_FIELDS):
+    """結果をCSVとJSONに書き出す"""
+    with open(output_prefix + ".csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for row in results:
+            writer.writerow({key: row.get(key) for key in fields})
+    with open(output_prefix + ".json", "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="合成データでcreate_scheduleのベンチマークを実行する")
+    parser.add_argument("--people", type=int, nargs="+", default=[20, 40])
+    parser.add_argument("--days", type=int, nargs="+", default=[31, 62])
+    parser.add_argument("--ng-density", type=float, nargs="+", default=[0.3, 0.6])
+    parser.add_argument("--maru-density", type=float, nargs="+", default=[0.05],
+                        help="〇の密度。大きいほど〇を採用する人数の最大化が難しくなる")
+    parser.add_argument("--rinban", type=int, nargs="+", default=[0, 5])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--time-limit", type=float, default=30.0, help="1ケースあたりの探索の制限時間（秒）")
+    parser.add_argument("--num-workers", type=int, default=None, help="CP-SATの探索スレッド数（省略時は自動）")
+    parser.add_argument("--output", default="bench_results", help="結果ファイルの出力先（拡張子なし）")
+    parser.add_argument("--work-dir", default=None, help="生成したExcelファイルの保存先（省略時は一時フォルダ）")
+    parser.add_argument("--horizon-check", nargs="+", default=None, metavar="FILE",
+                        help="ベンチマークの代わりに、これらのファイルで期間分割モードの結果がまとめて解いた結果と同じかを確認する。"
+                             "違うものがあれば終了コード1で終わる")
+    parser.add_argument("--horizon-days", type=int, nargs="+", default=[14, 21, 28],
+                        help="--horizon-check で確認する区間の日数")
+    parser.add_argument("--horizon-step", type=int, default=None,
+                        help="--horizon-check で使う確定日数（省略時は区間の日数の3/4）")
+    args = parser.parse_args()
+
+    dutyAssign.setup_logging()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        if args.horizon_check:
+            results = check_horizon(args.horizon_check, args.horizon_days, args.horizon_step, args.time_limit,
+                                    work_dir, args.num_workers)
+        else:
+            results = run_benchmark(args.people, args.days, args.ng_density, args.rinban,
+                                    args.seeds, args.time_limit, work_dir, args.maru_density, args.num_workers)
+    write_results(results, args.output, HORIZON_CHECK_FIELDS if args.horizon_check else RESULT_FIELDS)
+    print(f"結果を {args.output}.csv / {args.output}.json に保存しました。")
+    if args.horizon_check:
+        mismatches = [row for row in results if row["match"] is False]
+        for row in mismatches:
+            print(f"期間分割モードの結果がまとめて解いた結果と違います: {row['file']} 区間={row['horizon_days']}日 "
+                  f"人数={row['num_people_assigned']} 希望点={row['preference_score']}")
+        if mismatches:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,67 @@ import sys
 import io
 import os
 import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.util
+import atexit
 import traceback
+import argparse
+import concurrent.futures
+import csv
+import glob
+import hashlib
+import contextlib
+import json
+import queue
+import threading
+import time
+import itertools
+from copy import copy, deepcopy
+from collections import defaultdict
+import ortools
 from ortools.sat.python import cp_model
-from openpyxl.styles import Border, Side, PatternFill, Font, Alignment
-import pandas as pd
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Border, Side, PatternFill, Font, Alignment, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
 
 # 標準出力と標準エラー出力のエンコーディングをUTF-8に設定
 # これにより、Electron(Node.js)側で文字化けせずに日本語を正しく受け取れるようになります。
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
-def setup_logging():
-    """ログ設定を初期化し、ユーザーのドキュメントフォルダにログを保存する"""
+# ログをファイルに書き出すバックグラウンドのスレッド（setup_loggingで作り直す）
+_log_listener = None
+
+def stop_log_listener():
+    """キューに残っているログを書き出してから、ログを書き出すスレッドを止める（何度呼んでもよい）"""
+    global _log_listener
+    listener, _log_listener = _log_listener, None
+    if listener is not None:
+        listener.stop()
+
+def open_log_file(path, file_mode):
+    """ログファイルのハンドラを作る
+
+    'w'なら前回のログを *.log.1 ... に残して新しいファイルから始め、LOG_MAX_BYTES を超えたら次のファイルに切り替える。
+    'a'なら追記だけする（複数のプロセスで同じファイルを切り替えないよう、切り替えは親プロセスに任せる）。
+    """
+    if file_mode != 'w':
+        return logging.FileHandler(path, file_mode, 'utf-8')
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                                   encoding='utf-8')
+    if os.path.getsize(path) > 0:
+        handler.doRollover()
+    return handler
+
+def setup_logging(file_mode='w', log_format='%(asctime)s - %(levelname)s - %(message)s'):
+    """ログ設定を初期化し、ユーザーのドキュメントフォルダにログを保存する
+
+    ログはキューに入れるだけで、ファイルへの書き込みはバックグラウンドのスレッド（QueueListener）が行う。
+    ソルバーの探索ログ（SOLVER_LOGGER_NAME）は solver_log.log に、それ以外は duty_assign.log に書き出す。
+    file_mode: 'w'なら起動時に新しいログにする（前回のログは *.log.1 に残る）、'a'なら追記（バッチモードの子プロセス用）
+    """
+    global _log_listener
     try:
         # ユーザーのドキュメントフォルダのパスを取得
         # os.path.expanduser("~") はホームディレクトリを指す (例: C:\Users\YourUser)
@@ -27,11 +76,24 @@ def setup_logging():
         os.makedirs(log_dir, exist_ok=True)
 
         log_file_path = os.path.join(log_dir, 'duty_assign.log')
+        solver_log_path = os.path.join(log_dir, 'solver_log.log')
+
+        file_handler = open_log_file(log_file_path, file_mode)
+        file_handler.addFilter(lambda record: not record.name.startswith(SOLVER_LOGGER_NAME))
+        solver_handler = open_log_file(solver_log_path, file_mode)
+        solver_handler.addFilter(logging.Filter(SOLVER_LOGGER_NAME))
+        log_queue = queue.Queue(-1)
+        stop_log_listener()
+        _log_listener = logging.handlers.QueueListener(log_queue, file_handler, solver_handler)
+        _log_listener.start()
+        # 書式はキューに入れるときに整える（ファイル側のハンドラは整えた文字列をそのまま書く）
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.setFormatter(logging.Formatter(log_format))
 
         logging.basicConfig(
             level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[logging.FileHandler(log_file_path, 'w', 'utf-8')] # 'w'で起動時にログをリセット
+            handlers=[queue_handler],
+            force=True,  # バッチモードの子プロセスでは、親から引き継いだ設定を置き換える
         )
         logging.info("ログ設定が正常に完了しました。ログはここに記録されます。")
     except Exception as e:
@@ -39,11 +101,100 @@ def setup_logging():
         print(f"致命的エラー: ログ設定に失敗しました。Error: {e}", file=sys.stderr)
         sys.exit(1)
 
+# 終了時に、キューに残ったログを書き出す（multiprocessingの子プロセスはatexitを呼ばずに終了するため、両方に登録する）
+atexit.register(stop_log_listener)
+multiprocessing.util.Finalize(None, stop_log_listener, exitpriority=10)
+
 # --- 定数定義 ---
 # マッピング
 VALUE_MAPPING = {"×": 0, "〇": 2, "輪番": 3, "\u3000": 1, " ": 1}
 SHIFT_TYPE_MAPPING = {"昼": 0, "夜": 1}
 
+# 勤務希望の数値コード（VALUE_MAPPINGと同じ値）
+PREF_NG = VALUE_MAPPING["×"]        # 勤務不可
+PREF_BLANK = VALUE_MAPPING["\u3000"]  # 空白（第二希望）
+PREF_MARU = VALUE_MAPPING["〇"]      # 第一希望
+PREF_RINBAN = VALUE_MAPPING["輪番"]  # 輪番
+
+# 前処理で値が確定しなかった（変数として残す）セルを表す値
+CELL_FREE = -1
+
+# 勤務回数に上限がある列の組（limited_groups）のルールの名前。診断モードで矛盾している条件を表示するときに使う
+RULE_FAMILY_LABELS = {
+    "rest_window": "勤務の間隔（夜勤務は7日、昼勤務は6日空ける）",
+    "prior_month": "前月の勤務からの間隔",
+    "night_then_day": "夜勤務の翌日の昼勤務は不可",
+    "day_then_night": "昼勤務の翌日の夜勤務は不可",
+    "day_night_pair": "昼夜連続勤務は両方〇のときだけ可",
+    "after_rinban": "輪番の後7日未満の夜勤務は不可",
+}
+
+# ルールの設定の既定値。create_scheduleのrules（dictまたはJSONファイル）か、入力Excelの「ルール」シートで項目ごとに上書きできる
+#   rest_days: 同じ人の勤務の間隔。夜勤務を含む組は night 日、昼勤務同士は day 日の間に2回以上勤務しない
+#   exempt_weekdays: 割り当てが不要な曜日（外部から医師が派遣されるため、当メンバーでの当直不要）
+#   people: 個人ごとの例外。名前 -> {"skip": 適用しないルール（RULE_FAMILY_LABELSのキー）のリスト}
+DEFAULT_RULES = {
+    "rest_days": {"night": 7, "day": 6},
+    "exempt_weekdays": ["木"],
+    "people": {"尾崎泰": {"skip": ["day_then_night"]}},  # 尾崎先生は昼勤務の翌日も夜勤務可能
+}
+# 入力Excelのルールのシート名と、1列目の項目名
+RULES_SHEET_NAME = "ルール"
+RULES_SHEET_ITEMS = {"休息日数": "rest_days", "割り当て不要の曜日": "exempt_weekdays", "個人の例外": "people"}
+RULES_SHEET_SHIFT_TYPES = {"夜": "night", "昼": "day"}
+
+# ログファイルの切り替え（1ファイルの上限のバイト数と、残す古いファイルの数）
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+# ソルバーの探索ログのロガー名（solver_log.log に書き出す）
+SOLVER_LOGGER_NAME = "dutyAssign.solver"
+
+# 解のキャッシュ。モデルの組み方を変えたときはバージョンを上げて古いキャッシュを使わないようにする
+SOLUTION_CACHE_VERSION = 3
+SOLUTION_CACHE_MAX_BYTES = 50 * 1024 * 1024
+# Excelファイルの読み込み結果のキャッシュ。読み込みの処理を変えたときはバージョンを上げる
+ROSTER_CACHE_VERSION = 1
+
+# 書き出したモデルのファイル（export_solver_model）の形式の版
+MODEL_EXPORT_VERSION = 1
+
+# ソルバーの設定の組（プロファイル）。parameters は CpSolver のパラメータ名 -> 値、
+# time_limit は探索全体の制限時間の既定値（秒。Noneなら制限なし。time_limitを指定したときはそちらを使う）
+# tune.py で計測した結果、複数スレッドでは既定のポートフォリオの方がLNSのみより最良解・最適性の証明とも速いため、
+# どのプロファイルもポートフォリオを使う（1スレッドでは両者に差はない）
+# linearization_level=2（LP緩和を強める）もどのプロファイルにも必要: 60人×92日・1スレッドでは、
+# 既定の1以下だと60秒で最初の解も見つからないが、2では2段とも最適性の証明まで約9秒
+SOLVER_PROFILES = {
+    # 速い下書き: 短い時間で打ち切り、それまでの最良解を使う
+    "draft": {"label": "速い下書き", "parameters": {"use_lns_only": False, "linearization_level": 2},
+              "time_limit": 10},
+    # バランス: 時間制限なし
+    "balanced": {"label": "バランス", "parameters": {"use_lns_only": False, "linearization_level": 2},
+                 "time_limit": None},
+    # 最適性の証明: 時間制限なし。LP緩和はbalancedでも強めるので、今はbalancedと同じ設定
+    # （cut_level・symmetry_level などを足しても、証明までの時間に一貫した差はなかった）
+    "optimal": {"label": "最適性の証明", "parameters": {"use_lns_only": False, "linearization_level": 2},
+                "time_limit": None},
+}
+DEFAULT_SOLVER_PROFILE = "balanced"
+
+# 期間分割モード: 前の区間から固定して引き継ぐ日数（休息ルールの間隔）と、
+# 勤務回数が必須勤務回数を期間に配分した目安から外れた1回ごとの減点
+HORIZON_LOOKBACK_DAYS = 7
+HORIZON_PACE_WEIGHT = 10
+# 期間分割モード: 期間全体の勤務表ができた後に、区間ごとに解き直して見直す回数の上限（改善がなければそこで止める）
+HORIZON_MAX_SWEEPS = 3
+# 期間分割モード: 区間の勤務表を作成できなかったときに、区間の始まりを前に広げてやり直す日数の上限
+HORIZON_RETRY_DAYS = 28
+
+# 修正モード: 以前の勤務表から変更した勤務1件ごとの減点の既定値
+# 1つのセルの希望点の最大（〇の2点）と同じにし、希望点を上げるためだけには勤務を変えないようにする
+# （0にすると以前の勤務表は初期解のヒントになるだけで、10セルほどの修正でも20件以上の勤務が変わることがある）
+REPAIR_DEVIATION_WEIGHT = 2
+
+# 別案の作成: これまでの案から最低限変えるセルの数（2人の勤務を1組入れ替えると4セル変わる）
+ALTERNATIVE_MIN_DISTANCE = 4
+
 # Excelレイアウトマーカー
 MARKER_PERSON_START = "start"
 MARKER_PERSON_END = "end"
@@ -59,543 +210,2485 @@ ROW_WEEKDAY = 1
 ROW_DATE = 2
 ROW_SHIFT_TYPE = 3
 
-def create_schedule(file_path):
-    # この関数が呼ばれた時点でログ設定が完了していることを確認
-    if not logging.getLogger().hasHandlers():
-        setup_logging()
-    logging.info(f"処理開始: {file_path}")
-    # Excelファイルの読み込み。1番目のシートを読む
-    input_df = pd.read_excel(file_path, sheet_name=0, header=None)
-    logging.info("Excelファイルの読み込み完了")
-    
-    # 勤務希望を数字に置き換え（〇：第一希望、空白：第二希望、×：勤務不可、輪番：当院管理当直とは無関係に必要な当直）
-    # value_mapping = {"×": 0, "〇": 2, "輪番": 3, "\u3000": 1, " ": 1} # 定数に置き換え
-    
-    # 名前データの範囲を特定（start, endを元ファイルに書いておく）
-    start_row = None 
-    end_row = None 
-    # 2列目のデータから名前の開始と終了行を探す
-    for idx, val in enumerate(input_df.iloc[:, COL_NAMES]):
-        if val == MARKER_PERSON_START:
-            start_row = idx + 1  # 名前の開始行は "start" の次の行
-        if val == MARKER_PERSON_END:
-            end_row = idx
-    if start_row is None or end_row is None:
-        raise ValueError("Excel内に名前の'start'または'end'マーカーが見つかりませんでした。")
-    logging.info(f"名前の範囲を特定: start_row={start_row}, end_row={end_row}")
-    
+def to_number(value):
+    """セルの値を数値（float）に変換する。変換できない値はNoneを返す（pd.to_numeric(errors='coerce')相当）"""
+    if isinstance(value, (bool, int, float)):
+        return None if value != value else float(value)  # NaNはNone
+    if isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+        return None if number != number else number
+    return None
+
+def preference_code(value):
+    """勤務希望のセル1つを数値コードに変換する
+
+    マーカー文字列はVALUE_MAPPINGの値に、数値セルはその値に、未記入やその他の文字列は空白(1)に変換する。
+    """
+    if isinstance(value, str) and value in VALUE_MAPPING:
+        return VALUE_MAPPING[value]
+    number = to_number(value)
+    if number is None:
+        return PREF_BLANK
+    return int(min(max(number, -128), 127))
+
+def decode_preferences(rows):
+    """勤務希望（〇×輪番空白）の行のリストを1セル1バイトのint8行列に変換する"""
+    return np.array([[preference_code(value) for value in row] for row in rows], dtype=np.int8).reshape(len(rows), -1)
+
+def _fit_row(row, width):
+    """read_onlyのシートは行ごとに長さが違うため、列数をwidthにそろえる"""
+    row = tuple(row[:width])
+    return row + (None,) * (width - len(row))
+
+def read_roster(file_path, recorder=None):
+    """勤務希望のExcelファイルから、マーカーで囲まれた範囲だけを読み込む
+
+    1番目のシートをopenpyxlのread_onlyモードで1行ずつ読み、parse_roster_rowsで勤務希望に変換する。
+    「ルール」シートがあれば、ルールの設定も読む。返り値はparse_roster_rowsと同じ。
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        # シートの寸法情報が正しくないファイルもあるため、実際のセルから読む
+        sheet.reset_dimensions()
+        roster = parse_roster_rows(sheet.iter_rows(values_only=True), recorder)
+        # ルールのシートがあれば、ルールの設定も読む
+        if RULES_SHEET_NAME in workbook.sheetnames:
+            roster["rules"] = read_rules_sheet(workbook[RULES_SHEET_NAME])
+    finally:
+        workbook.close()
+    return roster
+
+def read_roster_csv(file_path, recorder=None):
+    """勤務希望のExcelの1番目のシートをCSV（UTF-8）で保存したファイルを読み込む。返り値はparse_roster_rowsと同じ"""
+    def cell_value(value):
+        # Excelと同じく、空のセルはNone、数字だけのセルは数値にする
+        if value == "":
+            return None
+        number = to_number(value)
+        if number is None:
+            return value
+        return int(number) if number.is_integer() else number
+
+    with open(file_path, newline="", encoding="utf-8-sig") as f:
+        rows = ([cell_value(value) for value in row] for row in csv.reader(f))
+        return parse_roster_rows(rows, recorder)
+
+def roster_from_table(names, required_shifts, weekdays, dates, shift_types, preferences, num_past_columns=0,
+                      rules=None):
+    """表の形で渡された勤務希望から、read_rosterと同じ形のdictを作る（Excelを介さずに解くときに使う）
+
+    names, required_shifts: 1人1要素の名前と必須勤務回数
+    weekdays, dates, shift_types: 1列1要素の曜日・日にち・勤務タイプ（"昼"、"夜"、平日の1列はNone）
+                                  日にちが同じ数字の連続する列が1日分になる
+    preferences: 1人1行の勤務希望（"〇"・"×"・"輪番"・空白の文字列、またはVALUE_MAPPINGの数値コード）
+    num_past_columns: 先頭の何列が前月データか
+    行・列のインデックスは、Excelのシートで名前の'start'マーカーを昼/夜の行に置いたときと同じになる。
+    """
+    num_people = len(names)
+    num_columns = len(dates)
+    if len(required_shifts) != num_people or len(preferences) != num_people:
+        raise ValueError("名前・必須勤務回数・勤務希望の人数がそろっていません。")
+    if len(weekdays) != num_columns or len(shift_types) != num_columns:
+        raise ValueError("曜日・日にち・勤務タイプの列数がそろっていません。")
+    start_row = ROW_SHIFT_TYPE + 1
+    past_col = COL_NAMES + 1
+    start_col = past_col + int(num_past_columns)
+    end_col = past_col + num_columns
+    if not past_col <= start_col < end_col:
+        raise ValueError(f"前月データの列数が勤務希望の列数と合いません: {num_past_columns}")
+    padding = [None] * past_col
+    header_rows = [[None] * end_col for _ in range(ROW_SHIFT_TYPE + 1)]
+    header_rows[ROW_MARKERS][past_col] = MARKER_DATE_PAST
+    header_rows[ROW_MARKERS][start_col] = MARKER_DATE_START
+    header_rows[ROW_MARKERS][end_col - 1] = MARKER_DATE_END
+    header_rows[ROW_WEEKDAY] = padding + list(weekdays)
+    header_rows[ROW_DATE] = padding + list(dates)
+    header_rows[ROW_SHIFT_TYPE] = padding + list(shift_types)
+    header_rows[ROW_SHIFT_TYPE][COL_NAMES] = MARKER_PERSON_START
+    rows = [[None] * end_col for _ in range(start_row)]
+    rows += [padding + [None if value == "" else value for value in row] for row in preferences]
+    if any(len(row) != end_col for row in rows):
+        raise ValueError("勤務希望の列数が日にちの列数と合いません。")
+    return {
+        "start_row": start_row,
+        "end_row": start_row + num_people,
+        "past_col": past_col,
+        "start_col": start_col,
+        "end_col": end_col,
+        "names": [None] * start_row + list(names),
+        "required_shifts": [0] * start_row + [int(value) for value in required_shifts],
+        "weekdays": header_rows[ROW_WEEKDAY],
+        "date_numbers": [0] * past_col + [int(value) for value in dates],
+        "is_night": [1] * past_col + [SHIFT_TYPE_MAPPING.get(value, 1) for value in shift_types],
+        "header_rows": header_rows,
+        "pref": decode_preferences(rows),
+        "rules": rules,
+    }
+
+def read_roster_json(file_path, recorder=None):
+    """勤務希望をJSONファイルから読み込む
+
+    roster_from_tableの引数をキーにしたオブジェクト（rulesはルールの設定。省略可）:
+        {"names": [...], "required_shifts": [...], "weekdays": [...], "dates": [...], "shift_types": [...],
+         "preferences": [[...], ...], "num_past_columns": 7, "rules": {...}}
+    """
+    with open(file_path, encoding="utf-8") as f:
+        table = json.load(f)
+    try:
+        roster = roster_from_table(**table)
+    except TypeError as e:
+        raise ValueError(f"勤務希望のJSONファイルの項目が正しくありません: {file_path}, {e}")
+    if recorder is not None:
+        recorder.lap("read_json")
+    return roster
+
+def save_roster_npz(path, roster):
+    """読み込んだ勤務希望（read_rosterの返り値）を.npzファイルに保存する
+
+    勤務希望の行列はそのまま、それ以外の項目はJSON文字列で保存する（pickleは使わない）。
+    """
+    meta = {key: value for key, value in roster.items() if key != "pref"}
+    with open(path, "wb") as f:
+        np.savez(f, pref=np.ascontiguousarray(roster["pref"], dtype=np.int8),
+                 meta=np.array(json.dumps(meta, ensure_ascii=False, default=str)))
+
+def load_roster_npz(path, recorder=None):
+    """save_roster_npzで保存した勤務希望を読み込む"""
+    with np.load(path) as data:
+        roster = json.loads(str(data["meta"]))
+        roster["pref"] = data["pref"]
+    if recorder is not None:
+        recorder.lap("load_roster_npz")
+    return roster
+
+def roster_cache_path(file_path):
+    """Excelファイルの読み込み結果のキャッシュの保存先。ファイルの内容のハッシュ値で区別する"""
+    digest = hashlib.sha256(f"roster:{ROSTER_CACHE_VERSION}:".encode("utf-8"))
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return os.path.join(solution_cache_dir(), f"roster_{digest.hexdigest()}.npz")
+
+def load_roster(file_path, recorder=None, use_cache=True):
+    """入力ファイルの拡張子に応じて勤務希望を読み込む。返り値はread_rosterと同じ
+
+    .csv: Excelの1番目のシートをCSVで保存したもの、.json: read_roster_jsonの形式、
+    .npz: save_roster_npzで保存したもの、それ以外: Excelファイル
+    Excelファイルは、use_cacheなら読み込んだ結果を.npzで保存しておき（解のキャッシュと同じフォルダ）、
+    内容が同じファイルを次に読むときはExcelを開かずにそれを使う。
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".csv":
+        return read_roster_csv(file_path, recorder)
+    if extension == ".json":
+        return read_roster_json(file_path, recorder)
+    if extension == ".npz":
+        return load_roster_npz(file_path, recorder)
+    if not use_cache:
+        return read_roster(file_path, recorder)
+    cache_path = roster_cache_path(file_path)
+    try:
+        roster = load_roster_npz(cache_path, recorder)
+        os.utime(cache_path)  # 最近使ったものを削除対象から外す
+        logging.info(f"保存済みのExcelの読み込み結果を使用します: {cache_path}")
+        return roster
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"Excelの読み込み結果のキャッシュを読み込めませんでした: {cache_path}, Error: {e}")
+    roster = read_roster(file_path, recorder)
+    cache_dir = os.path.dirname(cache_path)
+    temp_path = cache_path + ".tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_roster_npz(temp_path, roster)
+        os.replace(temp_path, cache_path)
+        evict_solution_cache(cache_dir, SOLUTION_CACHE_MAX_BYTES)
+    except OSError as e:
+        logging.warning(f"Excelの読み込み結果のキャッシュの保存に失敗しました: {cache_path}, Error: {e}")
+    if recorder is not None:
+        recorder.lap("store_roster_cache")
+    return roster
+
+def parse_roster_rows(rows, recorder=None):
+    """勤務希望のシートの行（値のタプル）を先頭から順に読み、マーカーで囲まれた範囲だけを取り出す
+
+    1行目のpast/start/endマーカーで列の範囲を、2列目のstart/endマーカーで名前の範囲を決める。
+    名前の'end'マーカーの行まで読んだら残りの行は読まない。
+    DataFrameは作らず、勤務希望はそのままint8行列（decode_preferencesと同じコード）にする。
+
+    返り値はdictで、行・列のインデックスはExcelのシートと同じ（0始まり）:
+        start_row, end_row, past_col, start_col, end_col: マーカーから求めた範囲
+        names: 0〜end_row-1行目の名前（ヘッダー行を含む）
+        required_shifts: 各行の必須勤務回数
+        weekdays, date_numbers, is_night: 0〜end_col-1列目の曜日、日にち、夜勤務なら1
+        header_rows: 0〜3行目の元の値（出力のヘッダーに使う）
+        pref: 勤務希望のint8行列（end_row × end_col）
+        rules: 「ルール」シートから読んだルールの設定（シートが無ければNone）
+    """
+    rows = iter(rows)
     # 勤務希望の範囲を1行目から取得（past（先月のデータ始まり）, start, endを元ファイルに書いておく）
     past_col = None
     start_col = None
     end_col = None
-    # 1行目のデータから "start"  "end" "past" を探す
-    for idx, val in enumerate(input_df.iloc[ROW_MARKERS, :]):
+    marker_row = next(rows, ())
+    for idx, val in enumerate(marker_row):
         if val == MARKER_DATE_START:
-            start_col = idx  
+            start_col = idx
         if val == MARKER_DATE_END:
             end_col = idx+1
         if val == MARKER_DATE_PAST:
             past_col = idx
-    
     if start_col is None or end_col is None or past_col is None:
         raise ValueError("Excel内に'start'または'end'または'past'マーカーが見つかりませんでした。")
     logging.info(f"日付の範囲を特定: start_col={start_col}, end_col={end_col}, past_col={past_col}")
     
-    # 名前リスト
-    names = input_df.iloc[0:end_row, COL_NAMES].tolist()
-    # 個別対応をしたいときに使う
-    ozaki_row = names.index("尾崎泰")  # 特定の人物の行番号を取得
+    # 2行目以降は勤務希望の範囲（end_col列目まで）だけを読む。名前の'end'マーカーの行で打ち切る
+    start_row = None
+    end_row = None
+    table = [_fit_row(marker_row, end_col)]
+    for idx, row in enumerate(rows, start=1):
+        row = _fit_row(row, end_col)
+        val = row[COL_NAMES] if COL_NAMES < end_col else None
+        if val == MARKER_PERSON_END:
+            end_row = idx
+            break
+        if val == MARKER_PERSON_START:
+            start_row = idx + 1  # 名前の開始行は "start" の次の行
+        table.append(row)
+    if start_row is None or end_row is None:
+        raise ValueError("Excel内に名前の'start'または'end'マーカーが見つかりませんでした。")
+    logging.info(f"名前の範囲を特定: start_row={start_row}, end_row={end_row}")
+    if recorder is not None:
+        recorder.lap("read_rows")
+    
+    def header_row(r):
+        return table[r] if r < len(table) else (None,) * end_col
+    
+    def to_int(value, default):
+        number = to_number(value)
+        return default if number is None else int(number)
     
     # 3行目の数字が日にち（昼夜で同じ数字が連続している場合は1日分である）
-    date_numbers = input_df.iloc[ROW_DATE, 0:end_col].apply(pd.to_numeric, errors='coerce').fillna(0).astype(int).values.tolist()
-    date_numbers_withLastMonth = input_df.iloc[ROW_DATE, 0:end_col].tolist()
-    date_numbers_onlyLastMonth = input_df.iloc[ROW_DATE, 0:start_col].tolist()
-    
-    # 必須勤務回数（Excelの1列目）を取り込む
-    required_shifts = input_df.iloc[0:end_row, COL_REQUIRED_SHIFTS].apply(pd.to_numeric, errors='coerce').fillna(0).astype(int).values.tolist()
-    
-    # 勤務タイプ列（昼 or 夜）の列インデックスを設定
-    is_night = pd.to_numeric(input_df.iloc[ROW_SHIFT_TYPE, 0:end_col].replace(SHIFT_TYPE_MAPPING), errors='coerce').fillna(1).astype(int).tolist()
-    
-    # 日ごとの列インデックスリストを作成
-    day_indices = []
-    prev_num = None
-    for idx, num in enumerate(date_numbers):
-        if num != prev_num:
-            day_indices.append([idx])
+    date_numbers = [to_int(val, 0) for val in header_row(ROW_DATE)]
+    # 勤務タイプ（昼 or 夜）。昼以外は夜として扱う
+    is_night = [to_int(SHIFT_TYPE_MAPPING.get(val, val) if isinstance(val, str) else val, 1)
+                for val in header_row(ROW_SHIFT_TYPE)]
+    roster = {
+        "start_row": start_row,
+        "end_row": end_row,
+        "past_col": past_col,
+        "start_col": start_col,
+        "end_col": end_col,
+        "names": [row[COL_NAMES] for row in table],
+        # 必須勤務回数（Excelの1列目）
+        "required_shifts": [to_int(row[COL_REQUIRED_SHIFTS], 0) for row in table],
+        "weekdays": list(header_row(ROW_WEEKDAY)),
+        "date_numbers": date_numbers,
+        "is_night": is_night,
+        "header_rows": [list(header_row(r)) for r in range(ROW_SHIFT_TYPE + 1)],
+        # 前月データを含む全体のデータの〇×を数字に変換
+        "pref": decode_preferences(table),
+        "rules": None,
+    }
+    if recorder is not None:
+        recorder.lap("decode_preferences")
+    return roster
+
+def read_previous_schedule(file_path, roster):
+    """以前に出力した勤務表（*_assigned_people*.xlsx）から、各人の割り当てを読み込む
+
+    名前（1列目）で今回の勤務希望の行と対応づけ、列は勤務希望の範囲（start_col〜end_col）と同じ並びとみなす。
+    返り値: {行インデックス: 勤務希望の範囲の列数と同じ長さのint8配列（1:勤務、0:勤務なし、3:輪番）}
+    今回の勤務希望にいない人は無視する。
+    """
+    start_row = roster["start_row"]
+    end_row = roster["end_row"]
+    num_columns = roster["end_col"] - roster["start_col"]
+    row_of_name = {roster["names"][i]: i for i in range(start_row, end_row)}
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        sheet.reset_dimensions()
+        previous = {}
+        # 先頭の4行（曜日・日付などのヘッダー）の下に、1人1行で 〇・空白・輪番 が並んでいる
+        for row in sheet.iter_rows(min_row=ROW_SHIFT_TYPE + 2, values_only=True):
+            row = _fit_row(row, num_columns + 1)
+            if row[0] not in row_of_name:
+                continue
+            previous[row_of_name[row[0]]] = np.array(
+                [{"〇": 1, "輪番": PREF_RINBAN}.get(val, 0) for val in row[1:]], dtype=np.int8)
+    finally:
+        workbook.close()
+    if not previous:
+        raise ValueError(f"以前の勤務表に、今回の勤務希望と同じ名前の人が見つかりませんでした: {file_path}")
+    logging.info(f"以前の勤務表を読み込みました: {file_path}, 対応した人数={len(previous)}")
+    return previous
+
+def read_rules_sheet(sheet):
+    """「ルール」シートから、ルールの設定のdict（DEFAULT_RULESと同じ形）を作る
+
+    1行に1項目で、1列目に項目名、2列目に対象、3列目に値を書く。1行目は見出しとして読まない。
+        休息日数           | 夜 または 昼 | 日数
+        割り当て不要の曜日 | 曜日         |
+        個人の例外         | 名前         | 適用しないルール（RULE_FAMILY_LABELSのキーまたは表示名）
+    シートに書かれた項目だけを返し、書かれていない項目は既定値のままになる。
+    割り当て不要の曜日の対象を空にすると、すべての曜日に割り当てが必要になる。
+    """
+    family_of_label = {label: family for family, label in RULE_FAMILY_LABELS.items()}
+    rules = {}
+    sheet.reset_dimensions()
+    for row in sheet.iter_rows(min_row=2, values_only=True):
+        item, target, value = _fit_row(row, 3)
+        if item is None:
+            continue
+        key = RULES_SHEET_ITEMS.get(str(item).strip())
+        if key is None:
+            raise ValueError(f"「{RULES_SHEET_NAME}」シートに不明な項目があります: {item}")
+        target = str(target).strip() if target is not None else ""
+        if key == "rest_days":
+            if target not in RULES_SHEET_SHIFT_TYPES:
+                raise ValueError(f"休息日数の対象は「夜」または「昼」にしてください: {target}")
+            days = to_number(value)
+            if days is None:
+                raise ValueError(f"休息日数（{target}）に日数を書いてください: {value}")
+            rules.setdefault(key, {})[RULES_SHEET_SHIFT_TYPES[target]] = int(days)
+        elif key == "exempt_weekdays":
+            rules.setdefault(key, [])
+            if target:
+                rules[key].append(target)
         else:
-            day_indices[-1].append(idx)
-        prev_num = num
-    
-    # 列インデックスから日付インデックス（ペアのインデックス）へのマッピングを作成。前月データを含まない。
-    column_to_day_map = {
-        col_idx: day_idx
-        for day_idx, day_group in enumerate(day_indices)
-        for col_idx in day_group
+            value = str(value).strip() if value is not None else ""
+            skipped = rules.setdefault(key, {}).setdefault(target, {"skip": []})["skip"]
+            skipped.append(family_of_label.get(value, value))
+    return rules
+
+def resolve_rules(rules=None, roster=None):
+    """既定値（DEFAULT_RULES）に、指定されたルールの設定を項目ごとに重ねたdictを返す
+
+    rules: ルールの設定のdict、またはJSONファイルのパス
+           Noneなら入力Excelの「ルール」シート（roster["rules"]）を使い、それも無ければ既定値のまま
+    休息日数は夜・昼ごとに、ほかの項目は項目ごと置き換える（個人の例外を書くと、既定の例外は使わない）。
+    """
+    if isinstance(rules, str):
+        with open(rules, encoding="utf-8") as f:
+            rules = json.load(f)
+    if rules is None and roster is not None:
+        rules = roster.get("rules")
+    resolved = deepcopy(DEFAULT_RULES)
+    for key, value in (rules or {}).items():
+        if key not in resolved:
+            raise ValueError(f"ルールの設定に不明な項目があります: {key}")
+        if key == "rest_days":
+            resolved[key].update(value)
+        else:
+            resolved[key] = deepcopy(value)
+    return resolved
+
+def compile_rules(rules, roster):
+    """ルールの設定（resolve_rulesの返り値）を、モデルの作成で使う配列に変換する
+
+    返り値はdict:
+        night_rest_days, day_rest_days: 夜勤務を含む組・昼勤務同士の勤務の間隔（日数）
+        is_exempt: 列ごとに、割り当てが不要ならTrue（end_col列）
+        applies: ルール（RULE_FAMILY_LABELSのキー） -> 行ごとに、そのルールを適用するならTrue（end_row行）
+        exception_rows: 個人の例外がある行の集合
+    勤務希望にいない人の例外は無視する。
+    """
+    start_row = roster["start_row"]
+    end_row = roster["end_row"]
+    night_rest_days = int(rules["rest_days"]["night"])
+    day_rest_days = int(rules["rest_days"]["day"])
+    if night_rest_days < 1 or day_rest_days < 1:
+        raise ValueError(f"休息日数は1日以上にしてください: 夜={night_rest_days}, 昼={day_rest_days}")
+    exempt_weekdays = set(rules["exempt_weekdays"])
+    is_exempt = np.array([weekday in exempt_weekdays for weekday in roster["weekdays"]], dtype=bool)
+    applies = {family: np.ones(end_row, dtype=bool) for family in RULE_FAMILY_LABELS}
+    row_of_name = {roster["names"][i]: i for i in range(start_row, end_row)}
+    exception_rows = set()
+    for name, person in rules["people"].items():
+        skipped = person.get("skip", [])
+        unknown = [family for family in skipped if family not in applies]
+        if unknown:
+            raise ValueError(f"ルールの設定に不明なルールがあります: {name}: {', '.join(map(str, unknown))}")
+        if name not in row_of_name:
+            logging.info(f"ルールの設定の個人の例外を無視します（勤務希望にいない人）: {name}")
+            continue
+        for family in skipped:
+            applies[family][row_of_name[name]] = False
+        exception_rows.add(row_of_name[name])
+    return {
+        "night_rest_days": night_rest_days,
+        "day_rest_days": day_rest_days,
+        "is_exempt": is_exempt,
+        "applies": applies,
+        "exception_rows": exception_rows,
+    }
+
+def build_calendar_index(roster, rule_config):
+    """日付・昼/夜・曜日の見出し行から、ルールで使う列ごとの情報をNumPy配列にまとめる
+
+    見出しは全員共通なので、1回の実行で1回だけ作り、各ルールはこの配列を参照する。
+    日の番号は、見出しの日付の数字が変わるところで1つ進む（名前などの列が0日目、前月データの列から1日目）。
+    返り値はdict（列ごとの配列は0〜end_col-1列目）:
+        day: 列ごとの日の番号
+        day_first_col, day_last_col: 日の番号ごとの最初・最後の列
+        is_night: 列ごとに、夜勤務ならTrue
+        is_exempt: 列ごとに、割り当てが不要な曜日ならTrue（compile_rulesの返り値と同じ）
+        rest_end: 列ごとに、翌日から夜勤務の休息日数の間（night_rest_days-1日後まで）の最後の列の次の列
+        prior_start: 列ごとに、夜勤務の休息日数の間だけ前（night_rest_days-1日前）の日の最初の列
+                     前月データの列より前になるときは-1
+    """
+    date_numbers = np.array(roster["date_numbers"][:roster["end_col"]])
+    is_new_day = np.ones(len(date_numbers), dtype=bool)
+    is_new_day[1:] = date_numbers[1:] != date_numbers[:-1]
+    day = np.cumsum(is_new_day) - 1
+    day_first_col = np.flatnonzero(is_new_day)
+    day_last_col = np.append(day_first_col[1:], len(date_numbers)) - 1
+    night_rest_days = rule_config["night_rest_days"]
+    rest_last_day = np.minimum(day + night_rest_days - 1, len(day_first_col) - 1)
+    prior_day = day - (night_rest_days - 1)
+    return {
+        "day": day,
+        "day_first_col": day_first_col,
+        "day_last_col": day_last_col,
+        "is_night": np.array(roster["is_night"][:roster["end_col"]]) == 1,
+        "is_exempt": rule_config["is_exempt"],
+        "rest_end": day_last_col[rest_last_day] + 1,
+        "prior_start": np.where(prior_day >= day[roster["past_col"]], day_first_col[np.maximum(prior_day, 0)], -1),
     }
+
+def rest_window_cliques(columns, is_night, day_of_column, night_rest_days=7, day_rest_days=6):
+    """休息ルール（既定は7日/6日。night_rest_days/day_rest_days で変えられる）で同時に勤務できない列の集合（クリーク）を列挙する
+
+    従来のペア制約 x[i, d1] + x[i, d2] <= 1 は、異なる日の2列で日の差が1～6日のとき（ただし昼勤務同士は1～5日のとき）に課されていた。
+    ここでは次の4種類のウィンドウを作り、各ウィンドウの列の合計を1以下とする。
+      - 夜勤務同士: 連続する7日間の夜勤務の列
+      - 昼勤務同士: 連続する6日間の昼勤務の列
+      - 昼->夜: ある日の昼勤務の列と、その後6日間の夜勤務の列
+      - 夜->昼: ある日の夜勤務の列と、その後6日間の昼勤務の列
+    どのウィンドウも「同じ日の列を含まず、任意の2列が従来のペア制約の対象」であり、
+    逆に従来のペアはすべていずれかのウィンドウに含まれるため、元のペア制約の集合と同値になる。
+    同じ日・同じ勤務タイプの列が複数ある場合は、1日1列ずつ選んだ組み合わせごとにウィンドウを作る。
+    day_of_column: 列ごとの日の番号（build_calendar_indexのday）
+    """
+    columns = list(columns)
+    if not columns:
+        return []
+    night_cols = defaultdict(list)  # 日付インデックス -> 夜勤務の列
+    day_cols = defaultdict(list)  # 日付インデックス -> 昼勤務の列
+    for d in columns:
+        if is_night[d] == 1:
+            night_cols[int(day_of_column[d])].append(d)
+        else:
+            day_cols[int(day_of_column[d])].append(d)
+    first_day = int(day_of_column[columns[0]])
+    last_day = int(day_of_column[columns[-1]])
+
+    cliques = []
+    def add_window(groups):
+        groups = [g for g in groups if g]
+        if len(groups) >= 2:  # 2日以上にまたがらないウィンドウは制約にならない
+            cliques.extend(list(c) for c in itertools.product(*groups))
+
+    for p in range(first_day, last_day + 1):
+        # 期間の末尾で切り詰められたウィンドウは、1つ前のウィンドウに含まれるので省略する
+        if p == first_day or p + night_rest_days - 1 <= last_day:
+            add_window([night_cols.get(q, []) for q in range(p, p + night_rest_days)])  # 夜勤務同士
+        if p == first_day or p + day_rest_days - 1 <= last_day:
+            add_window([day_cols.get(q, []) for q in range(p, p + day_rest_days)])  # 昼勤務同士
+        for d in day_cols.get(p, []):
+            add_window([[d]] + [night_cols.get(q, []) for q in range(p + 1, p + night_rest_days)])  # 昼->夜
+        for d in night_cols.get(p, []):
+            add_window([[d]] + [day_cols.get(q, []) for q in range(p + 1, p + night_rest_days)])  # 夜->昼
+    return cliques
+
+def add_lex_greater_equal(model, upper, lower, name):
+    """BoolVarの列 upper が lower 以上（辞書式順序）となる制約を追加する
+
+    prefix_equal は先頭からその位置の手前までが等しいことを表すBoolVarで、
+    等しい間は次の位置で upper >= lower でなければならない。
+    """
+    prefix_equal = None  # 先頭の位置では、手前までは常に等しい
+    for k, (a, b) in enumerate(zip(upper, lower)):
+        if prefix_equal is None:
+            model.Add(a >= b)
+        else:
+            model.Add(a >= b).OnlyEnforceIf(prefix_equal)
+        if k == len(upper) - 1:
+            break
+        # equal ⇔ prefix_equal かつ a == b（prefix_equal のもとでは a >= b なので、a == b は「aが0 または bが1」）
+        equal = model.NewBoolVar(f"{name}_{k}")
+        not_prefix = [] if prefix_equal is None else [prefix_equal.Not()]
+        if prefix_equal is not None:
+            model.AddImplication(equal, prefix_equal)
+        model.AddBoolOr([a.Not(), b]).OnlyEnforceIf(equal)
+        model.AddBoolOr([equal, a] + not_prefix)
+        model.AddBoolOr([equal, b.Not()] + not_prefix)
+        prefix_equal = equal
+
+class PhaseRecorder:
+    """工程ごとの所要時間と、規則ごとに追加された変数・制約の数を stats に記録する
+
+    lap(name) は前回の lap 以降の経過時間を name の工程として加算する。
+    model を渡すと、その間にモデルに増えた変数・制約の数も name ごとに加算する。
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.stats.setdefault("phases", {})
+        self.stats.setdefault("model_size", {})
+        self._last_time = time.perf_counter()
+        self._last_size = (0, 0)
+
+    def lap(self, name, model=None):
+        now = time.perf_counter()
+        phases = self.stats["phases"]
+        phases[name] = phases.get(name, 0.0) + now - self._last_time
+        self._last_time = now
+        if model is not None:
+            proto = model.Proto()
+            size = (len(proto.variables), len(proto.constraints))
+            entry = self.stats["model_size"].setdefault(name, {"variables": 0, "constraints": 0})
+            entry["variables"] += size[0] - self._last_size[0]
+            entry["constraints"] += size[1] - self._last_size[1]
+            self._last_size = size
+
+def resolve_solver_profile(name=None, overrides=None):
+    """ソルバーのプロファイルに、パラメータの上書きを重ねたdict（name, label, parameters, time_limit）を返す
+
+    CpSolverにないパラメータ名はValueErrorにする。
+    """
+    name = name or DEFAULT_SOLVER_PROFILE
+    if name not in SOLVER_PROFILES:
+        raise ValueError(f"ソルバーのプロファイルが見つかりません: {name}（{', '.join(SOLVER_PROFILES)}から選んでください）")
+    profile = dict(SOLVER_PROFILES[name], name=name)
+    profile["parameters"] = dict(profile["parameters"], **(overrides or {}))
+    parameters = cp_model.CpSolver().parameters
+    unknown = [key for key in profile["parameters"] if not hasattr(parameters, key)]
+    if unknown:
+        raise ValueError(f"CP-SATのパラメータではありません: {', '.join(unknown)}")
+    return profile
+
+def solver_response_stats(solver, progress_callback):
+    """CP-SATの求解結果の統計をdictにまとめる"""
+    response = solver.ResponseProto()
+    return {
+        "status": solver.StatusName(),
+        "objective": response.objective_value,
+        "best_objective_bound": response.best_objective_bound,
+        "wall_time": response.wall_time,
+        "user_time": response.user_time,
+        "deterministic_time": response.deterministic_time,
+        "num_booleans": response.num_booleans,
+        "num_conflicts": response.num_conflicts,
+        "num_branches": response.num_branches,
+        "num_solutions": progress_callback.solution_count,
+        "first_solution_seconds": progress_callback.first_solution_time,
+        "last_solution_seconds": progress_callback.last_solution_time,
+    }
+
+def add_notice(stats, message):
+    """利用者に伝える注意をログに残し、stats["notices"] に加える（create_scheduleが結果のメッセージに含める）
+
+    標準出力は結果とアプリとの通信（--progress のJSON）に使うため、求解の途中では print しない。
+    statsがNoneならログに残すだけ。同じ注意は1回だけ加える。
+    """
+    logging.info(message)
+    if stats is not None and message not in stats.setdefault("notices", []):
+        stats["notices"].append(message)
+
+def write_stats_sidecar(path, stats):
+    """計測結果をJSONファイルに書き出す。失敗しても処理は止めない"""
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2, default=str)
+        logging.info(f"計測結果を書き出しました: {path}")
+    except OSError as e:
+        logging.warning(f"計測結果の書き出しに失敗しました: {path}, Error: {e}")
+
+def export_solver_model(path, stages, variables, cells, meta):
+    """作成したCP-SATのモデルを、あとで解き直せる形で.npzファイルに書き出す
+
+    stages: 段ごとのdict（name: 段の名前、model: CpModelProtoのバイト列、parameters: SatParametersのバイト列）
+    variables: 勤務変数の (変数の番号, 行, 列) のリスト
+    cells: 当月の各セルの値（CELL_FREE: 変数、それ以外は確定した値）の行列
+    meta: 入力ファイル・名前・列の表示など、JSONにできる情報
+    モデルとパラメータはprotoのバイト列のまま、それ以外の項目はJSON文字列で保存する（pickleは使わない）。
+    """
+    arrays = {
+        "variables": np.array(variables, dtype=np.int32).reshape(-1, 3),
+        "cells": np.ascontiguousarray(cells, dtype=np.int8),
+        "meta": np.array(json.dumps(dict(meta, version=MODEL_EXPORT_VERSION, stages=[stage["name"] for stage in stages]),
+                                    ensure_ascii=False, default=str)),
+    }
+    for number, stage in enumerate(stages, start=1):
+        arrays[f"stage{number}_model"] = np.frombuffer(stage["model"], dtype=np.uint8)
+        arrays[f"stage{number}_parameters"] = np.frombuffer(stage["parameters"], dtype=np.uint8)
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+def replay_model(path, time_limit=None, solver_params=None, stats=None):
+    """export_solver_modelで書き出したモデルを、Excelを読まずに書き出したときのパラメータでそのまま解き直す
+
+    各段は書き出したときのモデル（前の段のスコアの下限とヒントを含む）を独立に解くので、段の順に依存しない。
+    time_limit: 指定すると、各段の制限時間をこの秒数に置き換える
+    solver_params: 書き出したパラメータを上書きするCpSolverのパラメータ（名前 -> 値のdict）
+    stats: dictを渡すと、段ごとの求解結果を書き込む（書き出したときの結果は recorded に入る）
+    返り値: status, stages（段ごとの求解結果）, result_matrix（最後に解が得られた段の割り当て。解が無ければNone）, meta
+    """
+    if stats is None:
+        stats = {}
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+        if meta.get("version") != MODEL_EXPORT_VERSION:
+            raise ValueError(f"モデルのファイルの形式が違います: {path}（版 {meta.get('version')}）")
+        variables = data["variables"]
+        cells = data["cells"]
+        stage_protos = [(data[f"stage{number}_model"].tobytes(), data[f"stage{number}_parameters"].tobytes())
+                        for number in range(1, len(meta["stages"]) + 1)]
+    stats["replay_file"] = path
+    stats["exported_with"] = meta.get("ortools_version")
+    stats["ortools_version"] = ortools.__version__
+    stats["recorded"] = meta.get("recorded")
+    stats["stages"] = []
+    status = "UNKNOWN"
+    solution = None
+    for stage, (stage_name, (model_bytes, parameter_bytes)) in enumerate(zip(meta["stages"], stage_protos), start=1):
+        model = cp_model.CpModel()
+        model.Proto().ParseFromString(model_bytes)
+        solver = cp_model.CpSolver()
+        solver.parameters.ParseFromString(parameter_bytes)
+        for name, value in (solver_params or {}).items():
+            setattr(solver.parameters, name, value)
+        enable_search_log(solver)
+        if time_limit is not None:
+            solver.parameters.max_time_in_seconds = float(time_limit)
+        progress_callback = SolutionProgressCallback(None, [], 0, stage)
+        stage_start = time.perf_counter()
+        stage_status = solver.Solve(model, progress_callback)
+        stats["stages"].append({"name": stage_name, "seconds": time.perf_counter() - stage_start,
+                                **solver_response_stats(solver, progress_callback)})
+        logging.info(f"{stage}段目（{stage_name}）の再実行完了. ステータス: {solver.StatusName(stage_status)}")
+        if stage_status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            status = solver.StatusName(stage_status)
+            solution = list(solver.ResponseProto().solution)
+        elif solution is None:
+            status = solver.StatusName(stage_status)
+    stats["status"] = status
     
-    # 辞書のすべての値をリストに変換
-    all_values = list(column_to_day_map.values())
+    # 勤務変数の値を、書き出したときの行・列の位置に戻す
+    result_matrix = None
+    if solution is not None:
+        result_matrix = cells.astype(int)
+        for index, i, d in variables.tolist():
+            result_matrix[i - meta["start_row"], d - meta["start_col"]] = solution[index]
+        result_matrix = result_matrix.tolist()
+    return {"status": status, "stages": stats["stages"], "result_matrix": result_matrix, "meta": meta}
+
+class SolutionProgressCallback(cp_model.CpSolverSolutionCallback):
+    """改善解が見つかるたびに、段・〇を採用できた人数・希望点の合計・経過時間を通知するコールバック"""
+
+    def __init__(self, on_progress, assigned_literals, preference_expr, stage):
+        cp_model.CpSolverSolutionCallback.__init__(self)
+        self.on_progress = on_progress
+        self.assigned_literals = assigned_literals
+        self.preference_expr = preference_expr
+        self.stage = stage
+        self.solution_count = 0
+        self.first_solution_time = None
+        self.last_solution_time = None
+
+    def on_solution_callback(self):
+        self.solution_count += 1
+        if self.first_solution_time is None:
+            self.first_solution_time = self.WallTime()
+        self.last_solution_time = self.WallTime()  # 改善解だけが通知されるので、最後の解が最良解
+        if self.on_progress is None:
+            return
+        self.on_progress({
+            "stage": self.stage,
+            "num_people_assigned": sum(self.Value(lit) for lit in self.assigned_literals),
+            "preference_score": self.Value(self.preference_expr),
+            "elapsed": round(self.WallTime(), 3),
+            "solution_count": self.solution_count,
+        })
+
+def enable_search_log(solver):
+    """CP-SATの探索ログを、標準出力（Electronとの通信に使う）には出さず、ログのキューを介して solver_log.log に書き出す
+
+    log_callback は1行ごとにキューに入れるだけなので、探索を待たせない。
+    パラメータを設定した後に呼ぶ。log_search_progress が指定されていなければ有効にし（False なら探索ログは出ない）、
+    log_to_stdout は指定にかかわらず無効にする。
+    """
+    if not solver.parameters.HasField("log_search_progress"):
+        solver.parameters.log_search_progress = True
+    solver.parameters.log_to_stdout = False
+    solver.log_callback = logging.getLogger(SOLVER_LOGGER_NAME).info
+
+def diagnose_infeasibility(model, guards, time_limit=None):
+    """仮定リテラルで有効にした制約のうち、同時には満たせない組を求める
+
+    guards: {キー: 制約を有効にするBoolVar}
+    返り値: 矛盾の原因となっているキーのリスト（CP-SATの SufficientAssumptionsForInfeasibility）
+            矛盾がなければ（解が見つかれば）None
+    """
+    model.AddAssumptions(list(guards.values()))
+    solver = cp_model.CpSolver()
+    # 仮定リテラルによる矛盾の原因の抽出は1スレッドで行う
+    # 仮定リテラル付きの制約もLP緩和に入れ、回数の上限どうしの矛盾を早く証明できるようにする
+    solver.parameters.num_search_workers = 1
+    solver.parameters.linearization_level = 2
+    if time_limit is not None:
+        solver.parameters.max_time_in_seconds = float(time_limit)
+    enable_search_log(solver)
+    status = solver.Solve(model)
+    logging.info(f"診断モードの実行完了. ステータス: {solver.StatusName(status)}")
+    if status != cp_model.INFEASIBLE:
+        return None
+    key_of_index = {literal.Index(): key for key, literal in guards.items()}
+    return [key_of_index[index] for index in solver.SufficientAssumptionsForInfeasibility()]
+
+def stop_search_when_requested(stop_event, solve_finished, callback):
+    """停止要求（stop_event）が来たら探索を打ち切る。別スレッドで実行する"""
+    while not solve_finished.is_set():
+        if stop_event.wait(0.1):
+            logging.info("停止要求を受け付けたため、探索を打ち切ります。")
+            callback.StopSearch()
+            return
+
+def solution_cache_dir():
+    """解のキャッシュの保存先（ログフォルダの隣）"""
+    documents_path = os.path.join(os.path.expanduser("~"), "Documents")
+    return os.path.join(documents_path, "DutyAssignmentCache")
+
+def solution_cache_key(roster, rule_config, settings):
+    """勤務希望・必須勤務回数・昼夜・曜日・日付の並び・ルールの設定（compile_rulesの返り値）とソルバー設定から、
+    キャッシュのキー（ハッシュ値）を作る
+
+    名前や書式など、割り当てに影響しない部分を変えてもキーは変わらない。
+    """
+    digest = hashlib.sha256()
+    pref = np.ascontiguousarray(roster["pref"], dtype=np.int8)
+    digest.update(repr(pref.shape).encode("utf-8"))
+    digest.update(pref.tobytes())
+    if roster.get("fixed_cells") is not None:
+        digest.update(np.ascontiguousarray(roster["fixed_cells"], dtype=np.int8).tobytes())
+    fields = {
+        "version": SOLUTION_CACHE_VERSION,
+        "range": [roster[key] for key in ("start_row", "end_row", "past_col", "start_col", "end_col")],
+        "required_shifts": roster["required_shifts"],
+        "required_shifts_max": roster.get("required_shifts_max"),
+        "required_shifts_target": roster.get("required_shifts_target"),
+        "max_uncovered_shifts": roster.get("max_uncovered_shifts"),
+        "assigned_rows": roster.get("assigned_rows"),
+        "future": roster.get("future"),
+        "is_night": roster["is_night"],
+        "weekdays": roster["weekdays"],
+        "date_numbers": roster["date_numbers"],
+        "rules": {
+            "rest_days": [rule_config["night_rest_days"], rule_config["day_rest_days"]],
+            "exempt_columns": np.flatnonzero(rule_config["is_exempt"]).tolist(),
+            "skipped_rows": {family: np.flatnonzero(~applies).tolist()
+                             for family, applies in rule_config["applies"].items()},
+        },
+        "settings": settings,
+    }
+    digest.update(json.dumps(fields, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+def load_cached_solution(key):
+    """キャッシュから (割り当て結果の行列, 〇が1つ以上採用された人数, 希望点の合計) を読み込む。無ければNone"""
+    path = os.path.join(solution_cache_dir(), key + ".npz")
+    try:
+        with np.load(path) as cached:
+            result_matrix = cached["result_matrix"]
+            num_people_assigned = int(cached["num_people_assigned"])
+            preference_score = int(cached["preference_score"])
+        os.utime(path)  # 最近使ったものを削除対象から外す
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"キャッシュを読み込めませんでした: {path}, Error: {e}")
+        return None
+    return result_matrix, num_people_assigned, preference_score
+
+def store_cached_solution(key, result_matrix, num_people_assigned, preference_score, max_bytes=SOLUTION_CACHE_MAX_BYTES):
+    """割り当て結果と各段のスコアをキャッシュに保存し、合計サイズがmax_bytesを超えたら古いものから削除する"""
+    cache_dir = solution_cache_dir()
+    path = os.path.join(cache_dir, key + ".npz")
+    temp_path = path + ".tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(temp_path, "wb") as f:
+            np.savez_compressed(f, result_matrix=np.asarray(result_matrix, dtype=np.int8),
+                                num_people_assigned=num_people_assigned, preference_score=preference_score)
+        os.replace(temp_path, path)
+        evict_solution_cache(cache_dir, max_bytes)
+    except OSError as e:
+        logging.warning(f"キャッシュの保存に失敗しました: {path}, Error: {e}")
+
+def evict_solution_cache(cache_dir, max_bytes):
+    """キャッシュの合計サイズがmax_bytes以下になるまで、最後に使われたのが古いものから削除する"""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith(".npz"):
+            info = entry.stat()
+            entries.append((info.st_mtime, info.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        logging.info(f"古いキャッシュを削除しました: {path}")
+
+# 勤務表の書式（塗りつぶしの色は 薄い色, 濃い色 の順。行ごとに交互に使う）
+SCHEDULE_FILLS = {
+    "holiday": ("FFe0e0", "FFd0d0"),   # 土日祝: 薄い赤
+    "weekday": ("FAFAA0", "FAFA20"),   # 月火水金: 黄色
+    "thursday": ("F5F5F5", "D0D0D0"),  # 木: 灰色
+    "name": ("F5F5F5", "D0D0D0"),      # 名前列: 灰色
+}
+HOLIDAY_WEEKDAYS = ["土", "日", "祝"]
+WORKING_WEEKDAYS = ["月", "火", "水", "金"]
+
+def schedule_column_kind(weekday):
+    """曜日から列の塗りつぶしの種類を返す。該当しなければNone"""
+    if weekday in HOLIDAY_WEEKDAYS:
+        return "holiday"
+    if weekday in WORKING_WEEKDAYS:
+        return "weekday"
+    if weekday == "木":
+        return "thursday"
+    return None
+
+def add_schedule_styles(workbook):
+    """勤務表で使う書式をNamedStyleとしてブックに1回だけ登録し、種類ごとの書式名のdictを返す
+
+    "plain": フォント12・白い太罫線・中央揃え（塗りつぶしなし）
+    "<種類>:0" / "<種類>:1": plainに薄い色／濃い色の塗りつぶしを加えたもの
+    "outside": 表の外側のセル用。白い太罫線・中央揃えのみ（フォントは既定のまま）
+    """
+    white = Side(style='thick', color='FFFFFF')
+    border = Border(left=white, right=white, top=white, bottom=white)
+    alignment = Alignment(horizontal='center', vertical='center')
+    styles = {
+        "plain": NamedStyle(name="schedule_plain", font=Font(size=12), border=border, alignment=alignment),
+        "outside": NamedStyle(name="schedule_outside", font=copy(DEFAULT_FONT), border=border, alignment=alignment),
+    }
+    for kind, colors in SCHEDULE_FILLS.items():
+        for shade, color in enumerate(colors):
+            fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+            styles[f"{kind}:{shade}"] = NamedStyle(
+                name=f"schedule_{kind}_{shade}", font=Font(size=12), fill=fill, border=border, alignment=alignment)
+    for style in styles.values():
+        workbook.add_named_style(style)
+    return {key: style.name for key, style in styles.items()}
+
+def write_schedule_excel(output_filename, names, rows, weekdays, bordered_columns):
+    """勤務表をExcelに書き出す
+
+    書式はNamedStyleとして1回だけ登録し、write_onlyモードで各セルに最終的な書式を1回で設定する。
+    names: 1列目に書く名前（行ごと）
+    rows: 2列目以降に書く値（行ごと。先頭の4行はヘッダー）
+    weekdays: 2列目以降の各列の曜日。土日祝は赤、月火水金は黄色、木は灰色で2行目以降を塗る
+    bordered_columns: 白い罫線を引く列数（1列目から数える）。表より右の列にも罫線を引き、グリッド線を隠す
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Sheet1')
+    style_names = add_schedule_styles(workbook)
+    column_kinds = [schedule_column_kind(wd) for wd in weekdays]
     
-    # リストの最後の要素を取得
-    last_value = all_values[-1]
+    # 列幅と行の高さ（write_onlyモードでは行を書く前に設定する）
+    worksheet.column_dimensions['A'].width = 15
+    for j in range(len(column_kinds)):
+        worksheet.column_dimensions[openpyxl.utils.get_column_letter(j + 2)].width = 4
+    for j in range(1, len(rows) + 1):
+        worksheet.row_dimensions[j].height = 20
     
-    # 前月データを含む全体のデータの〇×を数字に変換
-    df_subset = input_df.iloc[0:end_row]
-    df_numeric = df_subset.replace(
-        VALUE_MAPPING
-    ).fillna(1).apply(pd.to_numeric, errors='ignore')
+    def styled_cell(value, style_name):
+        cell = WriteOnlyCell(worksheet, value=None if value == '' else value)
+        cell.style = style_name
+        return cell
     
-    # debug:  df_numericをCSVファイルに書き出す
-    # df_numeric.to_csv('df_numeric.csv', encoding='shift_jis', index=False)
+    outside_cells = max(bordered_columns - len(column_kinds) - 1, 0)
+    for row_idx, (name, values) in enumerate(zip(names, rows)):
+        if row_idx == 0:
+            # 1行目は塗りつぶさない
+            cells = [styled_cell(name, style_names["plain"])]
+            cells += [styled_cell(val, style_names["plain"]) for val in values]
+        else:
+            # 2行目から薄い色・濃い色を交互に使う
+            shade = (row_idx - 1) % 2
+            cells = [styled_cell(name, style_names[f"name:{shade}"])]
+            cells += [
+                styled_cell(val, style_names[f"{kind}:{shade}"] if kind else style_names["plain"])
+                for val, kind in zip(values, column_kinds)]
+        cells += [styled_cell(None, style_names["outside"]) for _ in range(outside_cells)]
+        worksheet.append(cells)
+    workbook.save(output_filename)
+
+def create_schedule(file_path, on_progress=None, stop_event=None, time_limit=None, stats=None, use_cache=True,
+                    previous_schedule=None, deviation_weight=None, repair_people=None, stage_time_limits=None,
+                    diagnose=False, num_workers=None, horizon_days=None, horizon_step=None,
+                    num_alternatives=0, alternative_distance=ALTERNATIVE_MIN_DISTANCE, break_symmetry=False,
+                    rules=None, roster=None, solver_profile=None, solver_params=None, export_model=None):
+    """当直表を作成してExcelに書き出し、結果のメッセージを返す
+
+    on_progress: 改善解が見つかるたびに途中経過のdictを受け取る関数
+    stop_event: セットされると探索を打ち切り、それまでの最良解を書き出す（threading.Event）
+    time_limit: 探索全体の制限時間（秒）。Noneなら制限なし
+    stage_time_limits: 1段目（〇が採用された人数）と2段目（希望点の合計）それぞれの制限時間（秒）の組
+                       Noneの段は制限なし（time_limitの残り時間まで）
+    stats: dictを渡すと、工程ごとの所要時間（秒）・モデルの規模・結果を書き込む
+           同じ内容は出力ファイルの隣の *.stats.json にも書き出す
+    use_cache: Trueなら、同じ入力・設定で以前に最適解が得られていれば求解を省略してその解を使う
+               Excelファイルの読み込み結果も保存しておき、同じ内容のファイルはExcelを開かずに読み込む
+    previous_schedule: 以前に出力した勤務表のパス。指定すると、その割り当てを初期解のヒントにして解き直す（修正モード）
+    deviation_weight: 修正モードで、以前の勤務表から変更した勤務1件ごとにスコアから引く点数
+                      Noneなら REPAIR_DEVIATION_WEIGHT。0にすると以前の勤務表はヒントになるだけで、変更は減らさない
+    repair_people: 修正モードで割り当てを変えてよい人の名前のリスト。それ以外の人は以前の勤務表のまま固定する
+                   Noneなら全員変更してよい
+    diagnose: Trueなら勤務表は作らず、条件が矛盾していないかを調べる（診断モード）
+              矛盾していれば、原因となっている人・日付・ルールの一覧をメッセージとして返す
+    num_workers: CP-SATの探索スレッド数。Noneなら自動（CPUのコア数）
+    horizon_days: 指定すると、期間をこの日数ずつの重なりのある区間に分けて順に解く（期間分割モード）
+                  3か月や1年分など、長い期間の勤務希望を1つのファイルで作るときに使う
+    horizon_step: 期間分割モードで、1つの区間の解から確定させる日数（次の区間の開始日までの日数）
+                  Noneなら horizon_days の3/4
+    num_alternatives: 最良の勤務表に加えて作る別案の数。別案は *_alt1.xlsx, *_alt2.xlsx ... に書き出す
+                      モデルは1回だけ作り、〇が採用された人数が同じで、それまでの案から
+                      alternative_distance セル以上異なる勤務表を、希望点の合計が大きい順に探す
+                      別案も time_limit の残りの時間で探し、時間が無くなればそこまでの別案だけを書き出す
+    break_symmetry: Trueなら、条件がすべて同じ人どうしの割り当ての入れ替えを除く制約を加える
+                    CP-SAT自身の対称性の検出が弱い版（古いOR-Tools）で、同じ条件の人が多いときに探索が速くなる
+    rules: ルールの設定（休息日数・割り当て不要の曜日・個人の例外）のdict、またはJSONファイルのパス（DEFAULT_RULESを参照）
+           Noneなら入力Excelの「ルール」シートを使い、それも無ければ既定値を使う
+    roster: 読み込み済みの勤務希望（read_roster・roster_from_tableなどの返り値）
+            指定するとfile_pathは読まず、出力ファイルの名前にだけ使う
+    solver_profile: ソルバーの設定の組の名前（SOLVER_PROFILESのキー）。Noneなら DEFAULT_SOLVER_PROFILE
+                    time_limitを指定しなければ、プロファイルの制限時間を使う
+    solver_params: プロファイルのパラメータを上書きするCpSolverのパラメータ（名前 -> 値のdict）
+    export_model: 作成したモデル・勤務変数と (人, 列) の対応・ソルバーのパラメータを書き出す.npzファイルのパス
+                  replay_model（コマンドラインでは --replay）で、Excelを読まずに同じ求解を再現できる
+                  書き出すときは保存済みの解は使わない。診断モード・期間分割モードでは使えない
+    """
+    if stats is None:
+        stats = {}
+    stats["input_file"] = file_path
+    stats["started_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    stats["notices"] = []  # 求解中の注意（add_notice）。結果のメッセージの前に付ける
+    recorder = PhaseRecorder(stats)
+    phase_start = time.perf_counter()
+    # この関数が呼ばれた時点でログ設定が完了していることを確認
+    if not logging.getLogger().hasHandlers():
+        setup_logging()
+    logging.info(f"処理開始: {file_path}")
+    # 勤務希望の読み込み。Excelファイルは1番目のシートのマーカーで囲まれた範囲だけを読む（CSV・JSON・.npzも可）
+    if roster is None:
+        roster = load_roster(file_path, recorder, use_cache=use_cache)
+    logging.info("勤務希望の読み込み完了")
+    stats["parse_seconds"] = time.perf_counter() - phase_start
+    rules = resolve_rules(rules, roster)
+    stats["rules"] = rules
+    profile = resolve_solver_profile(solver_profile, solver_params)
+    if time_limit is None:
+        time_limit = profile["time_limit"]
+    stats["solver_profile"] = profile
     
-    # 勤務希望の部分だけ取り出し（×や〇の部分）
-    df_numeric.index = names
+    options = {"on_progress": on_progress, "stop_event": stop_event, "time_limit": time_limit,
+               "use_cache": use_cache, "stage_time_limits": stage_time_limits, "num_workers": num_workers,
+               "break_symmetry": break_symmetry, "rules": rules, "solver_parameters": profile["parameters"]}
+    if horizon_days is not None:
+        if previous_schedule is not None or diagnose or num_alternatives or export_model is not None:
+            raise ValueError("期間分割モードは、修正モード・診断モード・別案の作成・モデルの書き出しと同時には使えません。")
+        solution = solve_horizon(roster, horizon_days, horizon_step, stats, **options)
+    else:
+        if diagnose and export_model is not None:
+            raise ValueError("診断モードでは、モデルは書き出せません。")
+        previous = read_previous_schedule(previous_schedule, roster) if previous_schedule is not None else None
+        if deviation_weight is None:
+            deviation_weight = REPAIR_DEVIATION_WEIGHT
+        solution = solve_roster(roster, stats, recorder, previous=previous, deviation_weight=deviation_weight,
+                                repair_people=repair_people, diagnose=diagnose, num_alternatives=num_alternatives,
+                                alternative_distance=alternative_distance, export_model=export_model, **options)
     
-    # 日数（列数）と人数（行数）
-    num_days = df_numeric.shape[1]
-    num_people = df_numeric.shape[0]
-    logging.info(f"データ準備完了: 人数={num_people}, 日数={num_days}")
+    if diagnose:
+        if not solution["conflicts"]:
+            message = "条件の矛盾は見つかりませんでした。"
+        else:
+            message = "勤務表を作成できません。次の条件が同時には満たせません:\n" + "\n".join(
+                f"  - {conflict}" for conflict in solution["conflicts"])
+        logging.info(message)
+        write_stats_sidecar(os.path.splitext(file_path)[0] + ".stats.json", stats)
+        return "\n".join(stats["notices"] + [message])
+    
+    if solution["status"] in ("OPTIMAL", "FEASIBLE"):
+        if "repair" in stats:
+            stats["repair"]["previous_schedule"] = previous_schedule
+        lines = stats["notices"] + [write_schedule_result(
+            file_path, roster, solution["result_matrix"], solution["num_people_assigned"],
+            solution["preference_score"], stats, recorder, time.perf_counter())]
+        for number, alternative in enumerate(solution.get("alternatives", []), start=1):
+            lines.append(f"別案{number}（最良の案から{alternative['distance']}セル変更）:")
+            lines.append(write_schedule_result(
+                file_path, roster, alternative["result_matrix"], alternative["num_people_assigned"],
+                alternative["preference_score"], dict(stats, alternative=number), recorder, time.perf_counter(),
+                suffix=f"_alt{number}"))
+        if num_alternatives and len(solution.get("alternatives", [])) < num_alternatives:
+            lines.append(f"条件を満たす別案は{len(solution.get('alternatives', []))}件しか見つかりませんでした。")
+        return "\n".join(lines)
+    
+    logging.warning("最適解が見つかりませんでした。")
+    lines = stats["notices"] + ["最適解が見つかりませんでした。"]
+    failed_window = solution.get("failed_window")
+    if failed_window is not None:
+        lines.append(f"{failed_window['number']}番目の区間（{failed_window['first_date']}日〜{failed_window['last_date']}日）"
+                     f"の勤務表を作成できませんでした。区間の日数（horizon_days）を長くするか、"
+                     f"期間分割モードを使わずに診断モード（--diagnose）で条件の矛盾を調べてください。")
+    elif solution["status"] == "INFEASIBLE":
+        lines.append("条件が矛盾しています。診断モード（--diagnose）で原因となっている人・日付・ルールを調べられます。")
+    write_stats_sidecar(os.path.splitext(file_path)[0] + ".stats.json", stats)
+    return "\n".join(lines)
 
-    # --- 「〇」希望を出した人数の計算 ---
-    # 目的の範囲をスライス
-    target_range = df_numeric.iloc[start_row:end_row, start_col:end_col]
-    # 各行に2が1つ以上含まれるか（any(axis=1)）を判定し、
-    # Trueの行を合計（sum()）する
-    num_rows_with_2 = (target_range == 2).any(axis=1).sum()
-    logging.info(f"「〇」の希望を1つ以上出している人数: {num_rows_with_2}人")
-    # --- ここまで ---
+def collect_limited_groups(roster, rule_config, recorder=None, stats=None):
+    """勤務回数に上限がある列の組を、ルール（RULE_FAMILY_LABELSのキー）ごとに集める
+
+    返り値: {ルール: [(行, 列のリスト, 上限回数), ...]}
+    上限0はその列が勤務不可であること、上限1はその中で高々1回しか勤務できないことを表す。
+    列の組は輪番のセル（勤務ありに確定）も含む。solve_rosterのモデルと validate_schedule の確認の両方で使う。
+    stats: dictを渡すと、利用者への注意を stats["notices"] に加える（add_notice）
+    """
+    start_row = roster["start_row"]
+    end_row = roster["end_row"]
+    start_col = roster["start_col"]
+    end_col = roster["end_col"]
+    pref = roster["pref"]
+    is_maru = pref == PREF_MARU
+    is_rinban = pref == PREF_RINBAN
+    night_rest_days = rule_config["night_rest_days"]
+    
+    def rule_rows(family):
+        """ルールを適用する行のリスト"""
+        return (np.flatnonzero(rule_config["applies"][family][start_row:end_row]) + start_row).tolist()
+    
+    # 列ごとの日の番号・昼夜・休息期間の範囲は全員共通なので、見出しから1回だけ求めておく
+    calendar = build_calendar_index(roster, rule_config)
+    day = calendar["day"]
+    is_night = calendar["is_night"]
+    month_cols = np.arange(start_col, end_col)
+    if recorder is not None:
+        recorder.lap("calendar_index")
+    
+    limited_groups = defaultdict(list)
+    
+    # 同じ人が7日未満（昼勤務同士は6日未満）に複数回勤務しないようにする制約（日数はルールの設定による）
+    # 夜勤務同士・昼->夜・夜->昼・昼->昼の4つのルールを、スライディングウィンドウごとの「高々1回」制約として追加する
+    # 各ルールの列の組は全員共通なので1回だけ求め、ルールを適用する行ごとにまとめて追加する
+    rest_cliques = rest_window_cliques(range(start_col, end_col), is_night, day,
+                                       night_rest_days, rule_config["day_rest_days"])
+    for i in rule_rows("rest_window"):
+        limited_groups["rest_window"].extend((i, clique, 1) for clique in rest_cliques)
+    logging.info(f"休息ルールのウィンドウ制約数: {len(rest_cliques)}件/人")
+    if recorder is not None:
+        recorder.lap("collect:rest_window")
+    
+    # 前月データに関して、同じ人が7日未満に複数回勤務しないようにする制約（夜勤務の場合。昼勤務を希望している場合は無視する）
+    # 月頭から6日目までの夜勤務の列ごとに、6日前から前日までの前月データの列を調べる（１週間ごとの勤務はOK）
+    first_nights = month_cols[is_night[month_cols] & (day[month_cols] - day[start_col] <= night_rest_days - 2)]
+    prior_start = calendar["prior_start"]
+    if (prior_start[first_nights] < 0).any():
+        add_notice(stats, "前月データが7日分以上コピーされていないため、前月データの制約は適用されません。")
+    prior_cols = {d1: list(range(prior_start[d1], start_col)) for d1 in first_nights.tolist() if prior_start[d1] >= 0}
+    # 列ごとに、前月データで勤務がある人
+    worked_before = {d1: (pref[:, cols] >= PREF_MARU).any(axis=1) for d1, cols in prior_cols.items()}
+    for i in rule_rows("prior_month"):
+        # 輪番希望であれば無視する（前月から1週間未満でも仕方がない）
+        limited_groups["prior_month"].extend(
+            (i, [d1], 0) for d1 in prior_cols if worked_before[d1][i] and not is_rinban[i, d1])
+    if recorder is not None:
+        recorder.lap("collect:prior_month")
+    
+    # 翌日の列と組にする列（当月の最後の列を除く）
+    pair_starts = month_cols[:-1]
+    
+    # 夜勤務の翌日は昼勤務不可
+    night_day_cols = pair_starts[is_night[pair_starts] & ~is_night[pair_starts + 1]].tolist()
+    for i in rule_rows("night_then_day"):
+        limited_groups["night_then_day"].extend((i, [d, d + 1], 1) for d in night_day_cols)
+    if recorder is not None:
+        recorder.lap("collect:night_then_day")
+    
+    # 昼勤務の翌日は夜勤務不可（個人の例外で外せる。既定では尾崎先生は昼勤務の翌日も夜勤務可能）
+    day_night_cols = pair_starts[~is_night[pair_starts] & is_night[pair_starts + 1]].tolist()
+    for i in rule_rows("day_then_night"):
+        limited_groups["day_then_night"].extend((i, [d, d + 1], 1) for d in day_night_cols)
+    if recorder is not None:
+        recorder.lap("collect:day_then_night")
+    
+    # 昼夜連続勤務は、希望していなければ不可
+    pair_cols = pair_starts[~is_night[pair_starts]]
+    both_maru = is_maru[:, pair_cols] & is_maru[:, pair_cols + 1]  # 昼夜両方に丸がある
+    for i in rule_rows("day_night_pair"):
+        limited_groups["day_night_pair"].extend((i, [d, d + 1], 1) for d in pair_cols[~both_maru[i]].tolist())
+    if recorder is not None:
+        recorder.lap("collect:day_night_pair")
+    
+    # 輪番の後も7日未満は勤務不可（夜勤務のみ不可、昼はOK）
+    # 輪番の日の翌日から休息日数の間の夜勤務の列。当月の列だけを調べる
+    rest_end = calendar["rest_end"]
+    after_cols = {}
+    for i in rule_rows("after_rinban"):
+        for d in (np.flatnonzero(is_rinban[i, start_col:end_col]) + start_col).tolist():
+            if d not in after_cols:
+                cols = np.arange(calendar["day_last_col"][day[d]] + 1, rest_end[d])
+                after_cols[d] = cols[is_night[cols]].tolist()
+            limited_groups["after_rinban"].extend((i, [nd], 0) for nd in after_cols[d])
+    if recorder is not None:
+        recorder.lap("collect:after_rinban")
+    return limited_groups
+
+def solve_roster(roster, stats, recorder, on_progress=None, stop_event=None, time_limit=None, use_cache=True,
+                 previous=None, deviation_weight=0, repair_people=None, stage_time_limits=None,
+                 diagnose=False, num_workers=None, num_alternatives=0, alternative_distance=ALTERNATIVE_MIN_DISTANCE,
+                 break_symmetry=False, rules=None, solver_parameters=None, export_model=None):
+    """読み込んだ勤務希望（read_rosterの返り値）からモデルを作って解き、結果をdictで返す
+
+    引数はcreate_scheduleと同じ（previousはread_previous_scheduleの返り値、
+    solver_parametersはresolve_solver_profileの返り値のparameters。Noneなら既定のプロファイル）。
+    deviation_weightの既定値は0で、previousは初期解のヒントにするだけ（期間分割モードの見直しで使う）。
+    export_model: 指定すると、各段を解く直前のモデルとパラメータをこのパスに書き出す（export_solver_model）
+    rosterには、read_rosterの項目に加えて次の項目があってもよい（期間分割モードで使う）:
+        fixed_cells: 値を確定させるセル（pref と同じ形のint8行列。CELL_FREE以外のセルはその値に固定）
+        required_shifts_max: 各行の勤務回数の上限。あれば勤務回数は required_shifts 以上この値以下とする
+        required_shifts_target: 各行の勤務回数の目安 (下限, 上限)。外れた1回ごとに HORIZON_PACE_WEIGHT 点減点する
+        max_uncovered_shifts: 割り当てが不要な列（木曜）の勤務の合計の上限
+        assigned_rows: 区間の外（または確定したセル）で〇が既に採用された人の行のリスト。人数の目的関数には数えない
+        future: 区間より後の期間の概要のdict。capacity/maru_capacity: end_colより後の各行の勤務回数/〇の勤務回数の上限、
+                columns: end_colより後の割り当てが必要な列数、maru_columns: 〇がある列数
+    返り値:
+        status: ソルバーのステータス名（"OPTIMAL", "FEASIBLE", "INFEASIBLE" など）
+        result_matrix, num_people_assigned, preference_score: 解が得られたときの割り当て結果とスコア
+        conflicts: 診断モードで見つかった矛盾する条件の説明のリスト（矛盾がなければ空）
+        alternatives: 別案のdict（result_matrix, num_people_assigned, preference_score, distance）のリスト
+    """
+    phase_start = time.perf_counter()
+    
+    # 勤務希望を数字に置き換え（〇：第一希望、空白：第二希望、×：勤務不可、輪番：当院管理当直とは無関係に必要な当直）
+    # value_mapping = {"×": 0, "〇": 2, "輪番": 3, "\u3000": 1, " ": 1} # 定数に置き換え
+    start_row = roster["start_row"]
+    end_row = roster["end_row"]
+    past_col = roster["past_col"]
+    start_col = roster["start_col"]
+    end_col = roster["end_col"]
+    
+    # 名前リスト
+    names = roster["names"]
+    # ルールの設定（休息日数・割り当て不要の曜日・個人の例外）を配列にしておく。個別対応はここに書き、ループの中では判定しない
+    rule_config = compile_rules(resolve_rules(rules, roster), roster)
+    is_exempt = rule_config["is_exempt"]
+    
+    date_numbers = roster["date_numbers"]
+    required_shifts = roster["required_shifts"]
+    weekdays = roster["weekdays"]
+    
+    
+    # 前月データを含む全体のデータの〇×を数字に変換（行・列インデックスはExcelのシートと同じ）
+    pref = roster["pref"]
+    
+    # debug:  prefをCSVファイルに書き出す
+    # np.savetxt('pref.csv', pref, fmt='%d', delimiter=',')
+    
+    # 勤務希望ごとのマスク（True/Falseの行列）
+    is_ng = pref == PREF_NG
+    is_maru = pref == PREF_MARU
+    is_rinban = pref == PREF_RINBAN
+    
+    # 日数（列数）と人数（行数）。勤務希望は'end'マーカーの列までしか読まない
+    num_days = end_col
+    num_people = end_row
+    logging.info(f"データ準備完了: 人数={num_people}, 日数={num_days}")
+    recorder.lap("preference_masks")
+    stats["num_people"] = end_row - start_row
+    stats["num_columns"] = end_col - start_col
+    stats["parse_seconds"] = stats.get("parse_seconds", 0.0) + time.perf_counter() - phase_start
+    phase_start = time.perf_counter()
+    
+    # 同じ入力・設定の最適解が保存されていれば、求解を省略してExcelの書き出しに進む
+    solver_parameters = dict(solver_parameters if solver_parameters is not None
+                             else SOLVER_PROFILES[DEFAULT_SOLVER_PROFILE]["parameters"])
+    solver_settings = dict(solver_parameters, time_limit=time_limit, stage_time_limits=stage_time_limits)
+    # 修正モードの結果は以前の勤務表によって変わるため、キャッシュは使わない
+    # モデルを書き出すときは、保存済みの解を使わずに必ずモデルを作る
+    cache_key = (solution_cache_key(roster, rule_config, solver_settings)
+                 if use_cache and previous is None and not diagnose and not num_alternatives and export_model is None
+                 else None)
+    cached = load_cached_solution(cache_key) if cache_key is not None else None
+    recorder.lap("solution_cache")
+    if cached is not None:
+        result_matrix, num_people_assigned, preference_score = cached
+        logging.info(f"保存済みの解を使用します: {cache_key}")
+        add_notice(stats, "前回と同じ入力のため、保存済みの勤務表を使用します。")
+        stats["cache"] = "hit"
+        stats["status"] = "OPTIMAL"
+        return {"status": "OPTIMAL", "result_matrix": result_matrix,
+                "num_people_assigned": num_people_assigned, "preference_score": preference_score}
+    stats["cache"] = "miss" if cache_key is not None else "disabled"
+    
+    # ========
+    # 前処理: 勤務の有無が確定しているセルを求める
+    # ========
+    # 確定したセルには変数を作らず、定数（0: 勤務なし, 1: 勤務あり）として扱う
+    
+    # 勤務回数に上限がある列の組を規則ごとに集める。(人, 列のリスト, 上限回数) の形で持つ
+    # 上限0はその列が勤務不可であること、上限1はその中で高々1回しか勤務できないことを表す
+    limited_groups = collect_limited_groups(roster, rule_config, recorder, stats)
+    
+    # 各セルの値: CELL_FREE（変数）、0（勤務なしに確定）、1（勤務ありに確定）
+    cell_value = np.full(pref.shape, CELL_FREE, dtype=np.int8)
+    # ×のところは割り当て不可
+    cell_value[is_ng] = 0
+    # 輪番は記載通り割り当て（1日に複数の輪番でもOK）
+    cell_value[is_rinban] = 1
+    # 期間分割モードで、前の区間の解から確定した割り当て
+    fixed_cells = roster.get("fixed_cells")
+    if fixed_cells is not None:
+        is_fixed = (fixed_cells != CELL_FREE) & ~is_rinban
+        cell_value[is_fixed] = fixed_cells[is_fixed]
+    # 上限回数が輪番（と確定した勤務）だけで埋まっている組では、残りのセルは勤務なしに確定する
+    # 診断モードでは、ルールごとに有効・無効を切り替えられるよう、ルールによる確定はせず制約として残す
+    for groups in limited_groups.values() if not diagnose else []:
+        for i, cols, limit in groups:
+            if np.count_nonzero(cell_value[i, cols] == 1) >= limit:
+                cell_value[i, [d for d in cols if cell_value[i, d] != 1]] = 0
+    # 輪番以外で勤務ありに確定したセル。勤務回数と各列の割り当て人数に数える
+    fixed_shifts = (cell_value == 1) & ~is_rinban
+    recorder.lap("presolve_fixed_cells")
     
     # モデルの作成
     model = cp_model.CpModel()
     
-    # 勤務変数の作成：x[i][d] = 1ならi番目のメンバーがd日目に勤務
+    # 勤務変数の作成：x[i][d] = 1ならi番目のメンバーがd日目に勤務。値が確定していないセルだけ作る
     x = {}
-    for i in range(start_row, end_row):
-        for d in range(start_col, end_col):
-            x[i, d] = model.NewBoolVar(f"x_{i}_{d}")
-    logging.info("CP-SATモデルと変数の作成完了")
+    free_cells = np.argwhere(cell_value[start_row:end_row, start_col:end_col] == CELL_FREE) + (start_row, start_col)
+    for i, d in free_cells.tolist():
+        x[i, d] = model.NewBoolVar(f"x_{i}_{d}")
+    logging.info(f"CP-SATモデルと変数の作成完了: 変数の数={len(x)} / セル数={(end_row - start_row) * (end_col - start_col)}")
+    recorder.lap("variables:x", model)
     
     # ========
     # 制約の設定 
     # ========
     
-    # ×のところは割り当て不可
-    for i in range(start_row, end_row):
-        for d in range(start_col, end_col):
-            if df_numeric.iloc[i, d] == 0:
-                model.Add(x[i, d] == 0)
+    # 診断モードでは、制約を (ルール, 人または列[, 列の組]) ごとの仮定リテラルで有効にする
+    guards = {}
+    def guarded(constraint, key):
+        if diagnose:
+            if key not in guards:
+                guards[key] = model.NewBoolVar(f"guard_{len(guards)}")
+            constraint.OnlyEnforceIf(guards[key])
+        return constraint
     
     # 勤務回数が指定回数に一致（ただし、輪番（= 3）は除外してカウント）
+    required_shifts_max = roster.get("required_shifts_max")
+    required_shifts_target = roster.get("required_shifts_target")
+    shift_counts = {}  # 行 -> (変数の勤務回数の式, 確定した勤務回数)
     for i in range(start_row, end_row):
-        model.Add(
-            sum(
-                x[i, d] for d in range(start_col, end_col)
-                if df_numeric.iloc[i, d] != 3
-            ) == required_shifts[i]
-        )
+        shifts = cp_model.LinearExpr.Sum([
+            x[i, d] for d in range(start_col, end_col) if (i, d) in x
+        ])
+        num_fixed = int(np.count_nonzero(fixed_shifts[i, start_col:end_col]))
+        shift_counts[i] = (shifts, num_fixed)
+        if required_shifts_max is not None and required_shifts_max[i] != required_shifts[i]:
+            # 期間分割モード: 区間ごとの勤務回数は範囲で指定する
+            guarded(model.AddLinearConstraint(
+                shifts, required_shifts[i] - num_fixed, required_shifts_max[i] - num_fixed
+            ), ("required_shifts", i))
+        else:
+            guarded(model.Add(shifts == required_shifts[i] - num_fixed), ("required_shifts", i))
+    recorder.lap("constraints:required_shifts", model)
     
     # 各勤務（各列）につき、輪番以外で必ず1人割り当てる（輪番がいてもいなくても1人必要）
     for d in range(start_col, end_col):
-        # 木曜日(外部から医師が派遣されるため、当メンバーでの当直不要)以外、割り当て人数が1人であるという制約を追加
-        if input_df.iloc[ROW_WEEKDAY, d] != '木':
-            model.Add(sum(x[i, d] 
-                          for i in range(start_row, end_row)
-                            if df_numeric.iloc[i, d] != 3) == 1
-                            )
-    
-    # 輪番は記載通り割り当て（1日に複数の輪番でもOK）
-    for i in range(start_row, end_row):
-        for d in range(start_col, end_col):
-            if df_numeric.iloc[i, d] == 3:
-                model.Add(x[i, d] == 1)
+        # 割り当て不要の曜日（既定は木曜日。外部から医師が派遣されるため、当メンバーでの当直不要）以外、割り当て人数が1人であるという制約を追加
+        if not is_exempt[d]:
+            guarded(model.Add(cp_model.LinearExpr.Sum([
+                x[i, d] for i in range(start_row, end_row) if (i, d) in x
+            ]) == 1 - int(np.count_nonzero(fixed_shifts[start_row:end_row, d]))), ("coverage", d))
+    # 期間分割モード: 割り当て不要の列（木曜）の勤務は、必須勤務回数の合計が割り当てが必要な列数を上回る分だけにする
+    # （区間ごとの勤務回数は範囲で指定するため、制限しないと後の区間で必要な勤務回数を使ってしまう）
+    max_uncovered_shifts = roster.get("max_uncovered_shifts")
+    if max_uncovered_shifts is not None:
+        uncovered_cols = [d for d in range(start_col, end_col) if is_exempt[d]]
+        uncovered_shifts = cp_model.LinearExpr.Sum([
+            x[i, d] for d in uncovered_cols for i in range(start_row, end_row) if (i, d) in x
+        ])
+        max_uncovered_shifts -= int(np.count_nonzero(fixed_shifts[start_row:end_row, uncovered_cols]))
+        model.Add(uncovered_shifts <= max_uncovered_shifts)
+    recorder.lap("constraints:coverage", model)
     
-    # 同じ人が7日未満に複数回勤務しないようにする制約 ## （夜勤務同士）
-    for i in range(start_row, end_row):
-        for d1 in range(start_col, end_col): # 最後の1日は調べない
-            if is_night[d1] == 1:  # 夜勤務のみ制約を適用
-                d1_position = column_to_day_map[d1]
-                if d1_position != last_value: # 最後の日は調べない
-                    if d1_position +6 < len(day_indices):  # 日数の範囲内であることを確認
-                        last_d2 = d1_position + 6
-                    else:
-                        last_d2 = len(day_indices) -1  # 日数の範囲を超えないようにする
-                    for d2 in range(day_indices[d1_position + 1][0], day_indices[last_d2][-1]+1):
-                        # if d2 <= len(is_night):
-                        if is_night[d2] == 1:  # 夜勤務同士のみ
-                                model.Add(x[i, d1] + x[i, d2] <= 1)
-    
-    # 同じ人が7日未満に複数回勤務しないようにする制約 ## （昼->夜）
-    for i in range(start_row, end_row):
-        for d1 in range(start_col, end_col):
-            if is_night[d1] != 1:  # 昼勤務
-                d1_position = column_to_day_map[d1]
-                if d1_position != last_value: # 最後の日は調べない
-                    if d1_position +6 < len(day_indices):  # 日数の範囲内であることを確認
-                        last_d2 = d1_position + 6
-                    else:
-                        last_d2 = len(day_indices) -1  # 日数の範囲を超えないようにする
-                    for d2 in range(day_indices[d1_position + 1][0], day_indices[last_d2][-1]+1):
-                        # if d2 <= len(is_night):
-                        if is_night[d2] == 1:  # 夜勤務
-                                model.Add(x[i, d1] + x[i, d2] <= 1)
-    
-    # 同じ人が7日未満に複数回勤務しないようにする制約 ## （夜->昼）
-    for i in range(start_row, end_row):
-        for d1 in range(start_col, end_col):
-            if is_night[d1] == 1:  # 夜勤務
-                d1_position = column_to_day_map[d1]
-                if d1_position != last_value: # 最後の日は調べない
-                    if d1_position +6 < len(day_indices):  # 日数の範囲内であることを確認
-                        last_d2 = d1_position + 6
-                    else:
-                        last_d2 = len(day_indices) -1  # 日数の範囲を超えないようにする
-                    for d2 in range(day_indices[d1_position + 1][0], day_indices[last_d2][-1]+1):
-                        # if d2 <= len(is_night):
-                        if is_night[d2] != 1:  # 昼勤務
-                                model.Add(x[i, d1] + x[i, d2] <= 1)
-    
-    # 前月データに関して、同じ人が7日未満に複数回勤務しないようにする制約（夜勤務の場合。昼勤務を希望している場合は無視する）
-    for i in range(start_row, end_row):
-        for d1 in range(start_col, end_col):
-            if is_night[d1] == 1:  # 夜勤務のみ制約を適用
-                d1_position = column_to_day_map[d1] # 月頭から何日目かを示す
-                start_d1_position = column_to_day_map[start_col]
-                end_d1_position = start_d1_position + 5 # 月頭から6日目まで調べればいい
-                if d1_position <= end_d1_position:
-                    for d2 in range(day_indices[d1_position - 6][0], # １週間ごとの勤務はOK。
-                                    day_indices[d1_position - 1][-1]):
-                        if d2 >= 0:  # 前月データの範囲内であることを確認
-                            if df_numeric.iloc[i, d2] >= 2:  # 前月データで勤務がある場合
-                                if df_numeric.iloc[i, d1] != 3:  # 輪番希望であれば無視する（前月から1週間未満でも仕方がない）
-                                    model.Add(x[i, d1] == 0)
-                        else:
-                            print("前月データが7日分以上コピーされていないため、前月データの制約は適用されません。")
-    
-    # 夜勤務の翌日は昼勤務不可
-    for i in range(start_row, end_row):
-        for d in range(start_col, end_col - 1):
-            if is_night[d] == 1:  # 夜勤務の場合
-                if is_night[d + 1] == 0:  # 翌日は昼勤務の場合
-                    model.Add(x[i, d] + x[i, d + 1] <= 1)  # 翌日は昼勤務不可
-    
-    # 昼勤務の翌日は夜勤務不可
-    for i in range(start_row, end_row):
-        for d in range(start_col, end_col - 1):
-            if is_night[d] != 1:  # 昼勤務の場合
-                if is_night[d + 1] == 1:  # 続いて夜勤務の場合
-                    if i != ozaki_row:  # 尾崎先生は昼勤務の翌日も夜勤務可能
-                        model.Add(x[i, d] + x[i, d + 1] <= 1)  # 翌日は昼勤務不可
+    # 期間分割モード: 見通し用の列より後の期間を、人ごとの勤務回数だけで表す（区間の中の割り当てが後の区間を解けなくしないように）
+    #   区間より後の勤務回数 = 必須勤務回数の残り - 区間の勤務回数
+    #   区間より後の勤務回数は、人ごとの上限（勤務できる日と休息日数から求めた値）を超えない
+    #   区間より後の勤務回数の合計は、区間より後の割り当てが必要な列数（+ 木曜に勤務できる残りの回数）
+    #   区間より後の勤務のうち〇の回数と、それで〇が採用される人を目的関数に入れる（後の区間の列ごとの重なりは見ない）
+    future = roster.get("future")
+    future_shifts = {}  # 行 -> 区間より後の勤務回数の変数
+    future_maru_shifts = {}  # 行 -> 区間より後の〇の勤務回数の変数
+    future_assigned = {}  # 行 -> 区間より後の〇で採用されるかどうかのリテラル
+    if future is not None:
+        for i in range(start_row, end_row):
+            shifts, num_fixed = shift_counts[i]
+            remaining = required_shifts_max[i] - num_fixed
+            future_shifts[i] = model.NewIntVar(0, max(min(remaining, future["capacity"][i]), 0), f"future_shifts_{i}")
+            model.Add(future_shifts[i] == remaining - shifts)
+            future_maru_shifts[i] = model.NewIntVar(0, max(min(remaining, future["maru_capacity"][i]), 0),
+                                                    f"future_maru_shifts_{i}")
+            model.Add(future_maru_shifts[i] <= future_shifts[i])
+            if future["maru_capacity"][i] > 0 and remaining > 0:
+                future_assigned[i] = model.NewBoolVar(f"future_assigned_{i}")
+                model.Add(future_maru_shifts[i] >= 1).OnlyEnforceIf(future_assigned[i])
+        total_future = cp_model.LinearExpr.Sum(list(future_shifts.values()))
+        model.Add(total_future >= future["columns"])
+        if max_uncovered_shifts is not None:
+            model.Add(total_future + uncovered_shifts <= future["columns"] + max_uncovered_shifts)
+        model.Add(cp_model.LinearExpr.Sum(list(future_maru_shifts.values())) <= future["maru_columns"])
+        recorder.lap("constraints:future", model)
     
-    # 昼夜連続勤務は、希望していなければ不可
-    for i in range(start_row, end_row):
+    # 修正モード: 以前の勤務表の割り当てをヒントにし、変更してよい人以外は固定する
+    previous = previous or {}
+    repair_rows = None if repair_people is None else {i for i in range(start_row, end_row) if names[i] in repair_people}
+    changed_shifts = []  # 以前の勤務表から変わったら1になる式
+    for i, previous_row in previous.items():
         for d in range(start_col, end_col):
-            if is_night[d] == 0:  # 昼勤務の場合
-                if df_numeric.iloc[i, d] != 2 or df_numeric.iloc[i, d + 1] != 2: # 昼夜両方に丸がなければ
-                    model.Add(x[i, d] + x[i, d + 1] <= 1)
+            if (i, d) not in x:
+                continue
+            previous_value = int(previous_row[d - start_col] == 1)
+            if repair_rows is not None and i not in repair_rows:
+                guarded(model.Add(x[i, d] == previous_value), ("repair", i))
+            else:
+                model.AddHint(x[i, d], previous_value)
+                changed_shifts.append(1 - x[i, d] if previous_value else x[i, d])
+    if previous:
+        recorder.lap("constraints:repair", model)
     
-    # 同じ人が6日未満に複数回勤務しないようにする制約（昼->昼）（平日を跨げば可としたい）
-    for i in range(start_row, end_row):
-        for d1 in range(start_col, end_col):
-            if is_night[d1] != 1:  # 昼勤務のみ制約を適用
-                d1_position = column_to_day_map[d1]
-                if d1_position != last_value: # 最後の日は調べない
-                    if d1_position +5 < len(day_indices):  # 日数の範囲内であることを確認
-                        last_d2 = d1_position + 5
-                    else:
-                        last_d2 = len(day_indices) -1 # 日数の範囲を超えないようにする
-                    # if d1_position +7 < len(day_indices):  # 日数の範囲内であることを確認
-                    for d2 in range(
-                        day_indices[d1_position + 1][0], day_indices[last_d2][-1]+1):
-                        # if d2 < len(is_night):
-                        if is_night[d2] != 1:  # 昼勤務同士のみ
-                            model.Add(x[i, d1] + x[i, d2] <= 1)
+    # 勤務回数に上限がある列の組。確定したセルを除いても上限を超えうる場合だけ制約を追加する
+    # 前の区間で確定したセルだけの組は、前の区間を解いたときに確認済みなので除く（期間分割モード）
+    is_carried = fixed_cells != CELL_FREE if fixed_cells is not None else None
+    for family, groups in limited_groups.items():
+        for i, cols, limit in groups:
+            if is_carried is not None and is_carried[i, cols].all():
+                continue
+            free_vars = [x[i, d] for d in cols if (i, d) in x]
+            remaining = limit - np.count_nonzero(cell_value[i, cols] == 1)
+            if remaining < 0 or len(free_vars) > remaining:
+                guarded(model.Add(cp_model.LinearExpr.Sum(free_vars) <= remaining), (family, i, tuple(cols)))
+        recorder.lap(f"constraints:{family}", model)
     
-    # 輪番の後も7日未満は勤務不可（夜勤務のみ不可、昼はOK）
-    for i in range(start_row, end_row):
-        for d in range(start_col, end_col):
-            if df_numeric.iloc[i, d] == 3:  # 輪番の日
-                d_position = column_to_day_map[d]
-                if d1_position +6 < len(day_indices):  # 日数の範囲内であることを確認
-                    for offset in range(
-                        day_indices[d1_position + 1][-1], day_indices[d1_position + 6][-1]):
-                        nd = d + offset
-                        if 0 <= nd < num_days and nd != d:
-                            if is_night[nd] == 1:  # 夜勤務のみ不可
-                                model.Add(x[i, nd] == 0)
-    
-    # 割り当て日数をカウントするための変数のリストを定義
-    assigned_days_per_person = [
-        model.NewIntVar(0, end_col, f'assigned_days_{i}')
-        for i in range(0, end_row)
-    ]
-    for i in range(start_row, end_row):
-        model.Add(
-            assigned_days_per_person[i] ==
-            sum(x[i, d] for d in range(start_col, end_col
-                                       ) if df_numeric.iloc[i, d] == 2)
-        )
+    # 対称性の除去: 勤務希望（前月データを含む）・必須勤務回数・確定したセルがすべて同じで、個別対応もない人どうしは
+    # 割り当てを入れ替えても同じ価値の解になる。そのような人をグループにまとめ、break_symmetryなら
+    # グループ内では上の行の勤務の並びが下の行以上（辞書式順序）になる解だけを探す
+    # （最近のCP-SATは前処理で同じ対称性を見つけて使うため、制約を加えるとかえって遅くなることがある）
+    # 診断モードでは矛盾の説明に余計な制約が混ざらないよう、修正モードでは以前の勤務表がある人を除いて行う
+    if not diagnose:
+        symmetric_rows = defaultdict(list)
+        for i in range(start_row, end_row):
+            if i in rule_config["exception_rows"] or i in previous:
+                continue
+            symmetric_rows[(
+                pref[i, past_col:end_col].tobytes(),
+                cell_value[i, start_col:end_col].tobytes(),
+                required_shifts[i],
+                None if required_shifts_max is None else required_shifts_max[i],
+                None if required_shifts_target is None else tuple(required_shifts_target[i]),
+            )].append(i)
+        symmetric_groups = [rows for rows in symmetric_rows.values() if len(rows) > 1]
+        for rows in symmetric_groups if break_symmetry else []:
+            cols = [d for d in range(start_col, end_col) if (rows[0], d) in x]
+            for upper_row, lower_row in zip(rows, rows[1:]):
+                add_lex_greater_equal(model, [x[upper_row, d] for d in cols], [x[lower_row, d] for d in cols],
+                                      f"lex_{upper_row}_{lower_row}")
+        stats["symmetric_groups"] = [len(rows) for rows in symmetric_groups]
+        if symmetric_groups:
+            logging.info(f"同じ条件の人のグループ: {len(symmetric_groups)}組（{sum(map(len, symmetric_groups))}人）")
+        recorder.lap("constraints:symmetry", model)
+    
+    if diagnose:
+        core = diagnose_infeasibility(model, guards, time_limit)
+        recorder.lap("diagnose")
+        stats["build_seconds"] = time.perf_counter() - phase_start
+        conflicts = []
+        if core is not None:
+            def describe(key):
+                rule, index = key[:2]
+                if rule == "coverage":
+                    return f"{describe_column(roster, index)}: 1人の割り当てが必要"
+                if rule == "required_shifts":
+                    return f"{names[index]}: 必須勤務回数 {required_shifts[index]}回"
+                if rule == "repair":
+                    return f"{names[index]}: 以前の勤務表のまま固定"
+                first_day, last_day = date_numbers[min(key[2])], date_numbers[max(key[2])]
+                days_text = f"{first_day}日" if first_day == last_day else f"{first_day}日〜{last_day}日"
+                return f"{names[index]}: {RULE_FAMILY_LABELS.get(rule, rule)}（{days_text}）"
+            conflicts = [describe(key) for key in sorted(core, key=lambda key: (key[1], key[0]))]
+            stats["diagnosis"] = conflicts
+        return {"status": None, "conflicts": conflicts}
     
     # =========
     # 各人の〇が1回以上割り当てられたかどうかを確認する
     # =========
-    
-    # 1. 各人に対してブール変数を定義
-    # この変数は、その人が1日以上割り当てられた場合に True となります
-    is_assigned_at_all = [
-        model.NewBoolVar(f'is_assigned_at_all_{i}')
-        for i in range(0, end_row)
-    ]
-    
-    # 2. 割り当て日数とブール変数をリンクさせる制約を追加
+    # 〇のセルの変数から直接「〇が1つ以上採用された」リテラルを作る
+    # （割り当て日数の整数変数と条件付きの制約を介さないので、LP緩和と伝播が強くなる）
+    #   〇の変数が1つの人: その変数をそのまま使う
+    #   2つ以上の人: ブール変数を作り、〇の変数の最大値（論理和）と等しくなるよう節で結ぶ
+    #   〇の変数がない人: 常に0なので変数を作らない
+    #   〇が既に採用された人（期間分割モードで、区間の外で採用された人）: 常に1なので数えない
+    assigned_rows = set(roster.get("assigned_rows") or [])
+    assigned_literals = []
     for i in range(start_row, end_row):
-        # もし assigned_days_per_person[i] > 0 なら、is_assigned_at_all[i] は True
-        model.Add(assigned_days_per_person[i] > 0
-                  ).OnlyEnforceIf(is_assigned_at_all[i])
-        # もし assigned_days_per_person[i] == 0 なら、is_assigned_at_all[i] は False
-        model.Add(assigned_days_per_person[i] == 0
-                  ).OnlyEnforceIf(is_assigned_at_all[i].Not())
-    
-    # 3. ブール変数の合計を計算
-    # sum()はブール変数を自動的に 0 と 1 に変換して合計します
-    # `is_assigned_at_all`リストの要素のうち、start_rowからend_rowの範囲だけを合計
-    varianceOfAppliedMaru = sum(is_assigned_at_all[start_row:end_row])
+        if i in assigned_rows:
+            continue
+        maru_literals = [x[i, d] for d in np.flatnonzero(is_maru[i, start_col:end_col]) + start_col if (i, d) in x]
+        if i in future_assigned:
+            maru_literals.append(future_assigned[i])
+        if len(maru_literals) == 1:
+            assigned_literals.append(maru_literals[0])
+        elif maru_literals:
+            is_assigned = model.NewBoolVar(f"is_assigned_at_all_{i}")
+            # 採用されたなら〇のいずれかに勤務する。〇のどれかに勤務すれば採用された
+            model.AddBoolOr(maru_literals).OnlyEnforceIf(is_assigned)
+            for literal in maru_literals:
+                model.AddImplication(literal, is_assigned)
+            assigned_literals.append(is_assigned)
+    # 〇が1つ以上採用された人数
+    varianceOfAppliedMaru = cp_model.LinearExpr.Sum(assigned_literals)
     
     # 丸の総数を最大化
     # 〇が採用されれば2増える。空白が採用されれば1増える。
     # 3は輪番なので無視する
+    # 値が確定したセルは、×・輪番・勤務なしのいずれかなので目的関数には寄与しない
     totalAppliedMaru = sum(
-        df_numeric.iloc[i, d] * x[i, d]
-        for i in range(start_row, end_row)
-        for d in range(start_col, end_col)
-        if df_numeric.iloc[i, d] != 3
+        int(pref[i, d]) * x[i, d]
+        for i, d in free_cells.tolist()
     )
     
-    # 重み付け
-    # 丸の採用数は下二けた
-    weight_totalAppliedMaru = 1
-    # 一つ以上採用された人数は上二けた
-    # 〇を一人一つ以上採用することに重きを置いたscore
-    weight_varianceOfAppliedMaru = 1000
-    
-    # 最終的な目的関数
-    model.Maximize(totalAppliedMaru * weight_totalAppliedMaru +
-                    varianceOfAppliedMaru * weight_varianceOfAppliedMaru)
+    # 目的関数は2段階で最大化する（人数と希望点の合計を1つの重み付きの目的関数にまとめない）
+    # 1段目: 〇が1つ以上採用された人数だけを最大化する
+    # 2段目: 1段目の人数を下回らないよう固定し、1段目の解をヒントにして希望点の合計を最大化する
+    preference_objective = totalAppliedMaru
+    if deviation_weight and changed_shifts:
+        # 修正モード: 以前の勤務表からの変更を減点する（表示するスコアには含めない）
+        preference_objective = totalAppliedMaru - int(deviation_weight) * cp_model.LinearExpr.Sum(changed_shifts)
+    if required_shifts_target is not None:
+        # 期間分割モード: 勤務回数が目安から外れた回数を減点する（表示するスコアには含めない）
+        pace_deviations = []
+        for i in range(start_row, end_row):
+            shifts, num_fixed = shift_counts[i]
+            target_low, target_high = required_shifts_target[i]
+            deviation = model.NewIntVar(0, end_col, f"pace_deviation_{i}")
+            model.Add(deviation >= shifts - (target_high - num_fixed))
+            model.Add(deviation >= (target_low - num_fixed) - shifts)
+            pace_deviations.append(deviation)
+        preference_objective = preference_objective - HORIZON_PACE_WEIGHT * cp_model.LinearExpr.Sum(pace_deviations)
+    if future_shifts:
+        # 期間分割モード: 区間より後の勤務も希望点に数える（空白として1点、〇なら2点）
+        preference_objective = preference_objective + cp_model.LinearExpr.Sum(
+            list(future_shifts.values()) + list(future_maru_shifts.values()))
+    stage_limits = list(stage_time_limits) if stage_time_limits is not None else [None, None]
+    stages = [
+        ("people", varianceOfAppliedMaru, varianceOfAppliedMaru, stage_limits[0]),
+        ("preference", totalAppliedMaru, preference_objective, stage_limits[1]),
+    ]
     logging.info("全ての制約と目的関数の設定完了")
+    recorder.lap("objective", model)
+    stats["build_seconds"] = time.perf_counter() - phase_start
+    stats["num_variables"] = len(model.Proto().variables)
+    stats["num_constraints"] = len(model.Proto().constraints)
     
     # --- ソルバーの実行とログのファイル保存 ---
-    solver = cp_model.CpSolver()
-    # ソルバーの探索ログを有効にする
-    # solver.parameters.log_search_progress = True
-    # CP-SATソルバーの場合
-    # solver.parameters.num_search_workers = 1  # 1スレッドに限定
-    # solver.parameters.max_time_in_seconds = 1.0 # 1秒でテスト
-    solver.parameters.use_lns_only = True  # LNSのみを使用
-    # 実行不可能な場合(INFEASIBLE)に、原因となっている制約の調査を有効にする
-    # solver.parameters.num_workers = 1
-    # solver.parameters.log_infeasible_subsystem = True
-    # ソルバーのログを保存するファイルパスを定義
-    documents_path = os.path.join(os.path.expanduser("~"), "Documents")
-    log_dir = os.path.join(documents_path, "DutyAssignmentLogs")
-    solver_log_path = os.path.join(log_dir, 'solver_log.log')
-    # 元の標準出力を保存
-    original_stdout = sys.stdout
+    # 探索ログは標準出力を差し替えずに、log_callbackでログのキューに送る（enable_search_log）
     logging.info("ソルバーの実行開始")
-    # try:
-    #     # 標準出力をファイルにリダイレクト
-    #     with open(solver_log_path, 'w', encoding='utf-8') as f:
-    #         print("実行開始５", flush=True)
-    #         sys.stdout = f
-    status = solver.Solve(model)
-    # finally:
-    #     # 標準出力を元に戻す
-    #     sys.stdout = original_stdout
+    recorder.lap("solver_setup")
+    phase_start = time.perf_counter()
     
-    logging.info(f"ソルバーの実行完了. ステータス: {solver.StatusName(status)}")
+    def new_solver(max_time):
+        stage_solver = cp_model.CpSolver()
+        # ソルバーのプロファイルのパラメータ（探索ログは log_search_progress=False で止められる。スレッド数は num_search_workers）
+        for name, value in solver_parameters.items():
+            setattr(stage_solver.parameters, name, value)
+        enable_search_log(stage_solver)
+        if num_workers is not None:
+            stage_solver.parameters.num_search_workers = int(num_workers)
+        if max_time is not None:
+            stage_solver.parameters.max_time_in_seconds = float(max_time)
+        # 実行不可能な場合(INFEASIBLE)に、原因となっている制約の調査を有効にする
+        # stage_solver.parameters.num_workers = 1
+        # stage_solver.parameters.log_infeasible_subsystem = True
+        return stage_solver
     
-    # 最適解が得られたか確認
-    if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
-        # 最適解の目的関数の値を取得
-        optimal_score = solver.ObjectiveValue()
-
-        # スコアを「〇が1つ以上割り当てられた人数(上位桁)」と「希望点の合計(下位桁)」に分割
-        # 上位桁: 〇が1つ以上割り当てられた人数
-        num_people_assigned_score = int(optimal_score // weight_varianceOfAppliedMaru)
-        # 下位桁: 希望点の合計
-        total_preference_score = int(optimal_score % weight_varianceOfAppliedMaru)
-
-        # f-string内で改行文字 \n を使うことで、出力を複数行に分割
-        print(f"最大スコア: {optimal_score:.0f}\n"
-              f"内訳:\n"
-              f"  - 〇を一つ以上記載した人数: {num_rows_with_2}人\n"
-              f"  - 〇を一つ以上採用した人数: {num_people_assigned_score}人\n"
-              f"  - 〇の採用スコア: {total_preference_score}")
+    def solve_with_progress(stage_solver, stage):
+        progress_callback = SolutionProgressCallback(
+            on_progress, assigned_literals, totalAppliedMaru, stage)
+        solve_finished = threading.Event()
+        if stop_event is not None:
+            threading.Thread(target=stop_search_when_requested,
+                             args=(stop_event, solve_finished, progress_callback), daemon=True).start()
+        try:
+            stage_status = stage_solver.Solve(model, progress_callback)
+        finally:
+            solve_finished.set()
+        return stage_status, progress_callback
+    
+    # モデルの書き出し: 勤務変数の番号と (行, 列)、確定したセルの値、段ごとのモデルとパラメータ
+    exported_stages = []
+    def export_stages(recorded=None):
+        cells = cell_value[start_row:end_row, start_col:end_col].copy()
+        cells[is_rinban[start_row:end_row, start_col:end_col]] = PREF_RINBAN
+        export_solver_model(
+            export_model, exported_stages, [(var.Index(), i, d) for (i, d), var in x.items()], cells,
+            {"input_file": stats.get("input_file"), "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+             "ortools_version": ortools.__version__, "start_row": start_row, "start_col": start_col,
+             "names": names[start_row:end_row],
+             "columns": [describe_column(roster, d) for d in range(start_col, end_col)],
+             "num_workers": num_workers, "recorded": recorded})
+    
+    stats["stages"] = []
+    solver = None  # 解が得られた最後の段のソルバー
+    status = cp_model.UNKNOWN
+    proven = True  # ここまでの段がすべて最適か
+    for stage, (stage_name, stage_score, objective, stage_time_limit) in enumerate(stages, start=1):
+        if solver is not None:
+            # 前の段のスコアを下回らないよう固定し、前の段の解をヒントにする
+            model.Add(previous_score >= solver.Value(previous_score))
+            solution_hint = model.Proto().solution_hint
+            solution_hint.Clear()
+            solution_hint.vars.extend(range(len(incumbent)))
+            solution_hint.values.extend(incumbent)
+        # 全体の制限時間（time_limit）の残りと、段ごとの制限時間の短い方
+        if time_limit is not None:
+            remaining = max(float(time_limit) - (time.perf_counter() - phase_start), 0.0)
+            stage_time_limit = remaining if stage_time_limit is None else min(float(stage_time_limit), remaining)
+        seed = {}  # 1段目のヒントにする最初の解を求めたときの結果（段の結果に含める）
+        if stage == 1 and not previous:
+            # 人数だけの目的関数では勤務変数が目的関数に入らないため、探索が最初の解を見つけにくい
+            # （60人×92日・1スレッドでは30秒で見つからない）。希望点の合計を最大化する探索で最初の解を1つ求め、
+            # 1段目のヒントにする（最初の解で止めるので、目的関数の値は1段目・2段目の結果には影響しない）
+            # 修正モード・期間分割モードの見直しでは、以前の勤務表をヒントにしているので求めない
+            model.Maximize(preference_objective)
+            seed_solver = new_solver(stage_time_limit)
+            seed_solver.parameters.stop_after_first_solution = True
+            seed_start = time.perf_counter()
+            seed_status, seed_callback = solve_with_progress(seed_solver, stage)
+            seed_seconds = time.perf_counter() - seed_start
+            seed = {"seed_status": seed_solver.StatusName(seed_status), "seed_seconds": seed_seconds,
+                    "seed_first_solution_seconds": seed_callback.first_solution_time}
+            recorder.lap("solve:seed")
+            if stage_time_limit is not None:
+                stage_time_limit = max(float(stage_time_limit) - seed_seconds, 0.0)
+            if stop_event is not None and stop_event.is_set():
+                # 最初の解を求める間に停止要求が来たら、1段目は解かずに最初の解（無ければ解なし）を使う
+                # （解き始める前の停止要求は探索に届かないため）
+                found = seed_status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+                stats["stages"].append({"name": stage_name, "time_limit": stage_time_limit, "seconds": 0.0,
+                                        "status": "FEASIBLE" if found else seed_solver.StatusName(seed_status),
+                                        "score": seed_solver.Value(stage_score) if found else None, **seed})
+                stage_solver = seed_solver
+                if found:
+                    solver, status = seed_solver, cp_model.FEASIBLE
+                break
+            if seed_status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                solution_hint = model.Proto().solution_hint
+                solution_hint.Clear()
+                solution_hint.vars.extend(range(len(model.Proto().variables)))
+                solution_hint.values.extend(seed_solver.ResponseProto().solution)
+        model.Maximize(objective)
+        
+        stage_solver = new_solver(stage_time_limit)
+        if export_model is not None:
+            # 求解が終わらないときにも調べられるよう、解く前に書き出す
+            exported_stages.append({"name": stage_name, "model": model.Proto().SerializeToString(),
+                                    "parameters": stage_solver.parameters.SerializeToString()})
+            export_stages()
+        stage_start = time.perf_counter()
+        stage_status, progress_callback = solve_with_progress(stage_solver, stage)
+        
+        logging.info(f"{stage}段目（{stage_name}）の実行完了. ステータス: {stage_solver.StatusName(stage_status)}, "
+                     f"解の数: {progress_callback.solution_count}")
+        recorder.lap(f"solve:{stage_name}")
+        stats["stages"].append({
+            "name": stage_name,
+            "time_limit": stage_time_limit,
+            "seconds": time.perf_counter() - stage_start,
+            "score": stage_solver.Value(stage_score) if stage_status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None,
+            **solver_response_stats(stage_solver, progress_callback),
+            **seed,
+        })
+        if stage_status != cp_model.OPTIMAL and stage_status != cp_model.FEASIBLE:
+            # 2段目で解が得られなかったときは、1段目の解を使う（希望点の合計は最適とは限らない）
+            status = stage_status if solver is None else cp_model.FEASIBLE
+            break
+        solver = stage_solver
+        previous_score = stage_score
+        incumbent = list(stage_solver.ResponseProto().solution)
+        # どの段も最適性が証明できたときだけ、辞書式順序での最適解になる
+        proven = proven and stage_status == cp_model.OPTIMAL
+        status = cp_model.OPTIMAL if proven else cp_model.FEASIBLE
+        if stop_event is not None and stop_event.is_set():
+            # 残りの段を解かずに打ち切った解は、辞書式順序での最適解とは限らない
+            if stage < len(stages):
+                status = cp_model.FEASIBLE
+            break
+    
+    stats["solve_seconds"] = time.perf_counter() - phase_start
+    stats["status"] = (solver or stage_solver).StatusName(status)
+    if export_model is not None:
+        # 書き出したときの求解結果も残し、再実行の結果と比べられるようにする
+        export_stages(recorded=stats["stages"])
+        stats["exported_model"] = export_model
+        logging.info(f"モデルを書き出しました: {export_model}")
+    if stop_event is not None and stop_event.is_set():
+        add_notice(stats, "探索を中断しました。それまでに見つかった最良の勤務表を使用します。")
+    
+    def collect_result_matrix(solver):
         # 最適解の各変数の値からresult_matrixを再構築
         result_matrix = []
         for i in range(start_row, end_row):
             row = []
             for d in range(start_col, end_col):
-                if df_numeric.iloc[i, d] == 3:
-                    val = 3
-                else:
+                if is_rinban[i, d]:
+                    val = PREF_RINBAN
+                elif (i, d) in x:
                     # ソルバーから変数の値を取得
                     val = solver.Value(x[i, d])
+                else:
+                    # 前処理で値が確定したセル
+                    val = int(cell_value[i, d])
                 row.append(val)
             result_matrix.append(row)
+        return result_matrix
     
-        # 元データを使用してIndex情報を作成
-        header_data = input_df.iloc[0:4, start_col:end_col].copy()
-        header_data.fillna('', inplace=True)
-        header_array = header_data.values
-        combined_matrix = np.vstack((header_array, result_matrix)) 
-        # 列（日付）と行（名前）のラベル付きDataFrameを作成
-        pd.set_option('future.no_silent_downcasting', True)
-        result_df = pd.DataFrame(combined_matrix, index=names)
-        # result_df = result_df.astype(object) # 全体をobject型（文字列）に変換しておく
-        # 〇×表記＋輪番に変換
-        result_df.iloc[range(start_row, end_row),] = (
-        result_df.iloc[range(start_row, end_row),].replace({1: "〇", 0: "", 3: "輪番"})
-    )
-        display_df = result_df.copy()
-    
-        # 出力ファイル名を動的に生成
-        # 入力ファイルと同じディレクトリに出力ファイルを作成
-        output_dir = os.path.dirname(file_path)
-        # スコアを小数点1位に丸めてファイル名に含める
-        base_filename = os.path.splitext(os.path.basename(file_path))[0]
-        output_filename = os.path.join(output_dir, f"{base_filename}_assigned_score{optimal_score:.0f}.xlsx")
-    
-        logging.info(f"結果をExcelファイルに書き込み開始: {output_filename}")
-        # 以降はExcelに見栄えよく書き出すための設定（元のコードのまま）
-        with pd.ExcelWriter(output_filename, engine='openpyxl') as writer:
-            display_df.to_excel(writer, sheet_name='Sheet1', header=False)
-            worksheet = writer.sheets['Sheet1']
-    
-            # 列幅の調整
-            worksheet.column_dimensions['A'].width = 15
-            for j in range(len(display_df.columns)):
-                column_letter = openpyxl.utils.get_column_letter(j + 2)
-                worksheet.column_dimensions[column_letter].width = 4
-            
-            # 全ての行の高さを指定
-            for j in range(1, worksheet.max_row + 1):
-                worksheet.row_dimensions[j].height = 20
-    
-            # 全てのセルのフォントサイズを12に設定
-            for row in worksheet.iter_rows():
-                for cell in row:
-                    cell.font = Font(size=12)
-    
-            # 罫線と背景色の設定
-            white_thick_border = Border(left=Side(style='thick', color='FFFFFF'),
-                                        right=Side(style='thick', color='FFFFFF'),
-                                        top=Side(style='thick', color='FFFFFF'),
-                                        bottom=Side(style='thick', color='FFFFFF'))
-            light_red_fill_light = PatternFill(
-                start_color="FFe0e0", end_color="FFe0e0", fill_type="solid")
-            light_red_fill_dark = PatternFill(
-                start_color="FFd0d0", end_color="FFd0d0", fill_type="solid")
-            light_yellow_fill_light = PatternFill(
-                start_color="FAFAA0", end_color="FAFAA0", fill_type="solid")
-            light_yellow_fill_dark = PatternFill(
-                start_color="FAFA20", end_color="FAFA20", fill_type="solid")
-            light_grey_fill_light = PatternFill(
-                start_color="F5F5F5", end_color="F5F5F5", fill_type="solid")
-            light_grey_fill_dark = PatternFill(
-                start_color="D0D0D0", end_color="D0D0D0", fill_type="solid")
-            center_alignment = Alignment(
-                horizontal='center', vertical='center')
-    
-            weekdays_header = display_df.columns.get_level_values(0)
-            is_holiday_col = [
-                any(day in str(wd) for day in [
-                    "土", "日", "祝"
-                    ]) for wd in weekdays_header]
-            is_thirsday_col = [wd == "木" for wd in weekdays_header]
-    
-            row_of_weekdays = display_df.iloc[1]
-    
-            # その行をループし、「日」の列のインデックスを見つける
-            holidays = ["土", "日", "祝"]
-            holiday_column_indices = [
-                i for i, val in enumerate(row_of_weekdays) if val in holidays]
-    
-            weekdays = ["月", "火", "水", "金"]
-            weekdays_header_indices = [
-                i for i, val in enumerate(row_of_weekdays) if val in weekdays]
-    
-            thirsdays = ["木"]
-            thirsday_header_indices = [
-                i for i, val in enumerate(row_of_weekdays) if val in thirsdays]
-    
-            for col in holiday_column_indices:
-                alternate_row_color = False
-                for row in range(2, end_row + 1):
-                    alternate_row_color = not alternate_row_color
-                    cell = worksheet.cell(row=row, column=col + 2) # +2は名前列と1行目のヘッダーをスキップ
-                    cell.fill = light_red_fill_light if alternate_row_color else light_red_fill_dark
-    
-            for col in weekdays_header_indices:
-                alternate_row_color = False
-                for row in range(2, end_row + 1):
-                    alternate_row_color = not alternate_row_color
-                    cell = worksheet.cell(row=row, column=col + 2) # +2は名前列と1行目のヘッダーをスキップ
-                    cell.fill = light_yellow_fill_light if alternate_row_color else light_yellow_fill_dark
-            
-            for col in thirsday_header_indices:
-                alternate_row_color = False
-                for row in range(2, end_row + 1):
-                    alternate_row_color = not alternate_row_color
-                    cell = worksheet.cell(row=row, column=col + 2) # +2は名前列と1行目のヘッダーをスキップ
-                    cell.fill = light_grey_fill_light if alternate_row_color else light_grey_fill_dark
-    
-            col = 1 # 名前列
-            alternate_row_color = False
-            for row in range(2, end_row + 1):   
-                alternate_row_color = not alternate_row_color
-                cell = worksheet.cell(row=row, column=col) # 名前列
-                cell.fill = light_grey_fill_light if alternate_row_color else light_grey_fill_dark
-    
-            for row in range(1, end_row + 1):
-                for col in range(1, end_col + 1):
-                    cell = worksheet.cell(row=row, column=col)
-                    # 罫線を適用
-                    cell.border = white_thick_border
-            
-            # ヘッダーとインデックスのフォントを通常書体に変更
-            num_header_rows = display_df.columns.nlevels
-            for row_idx in range(1, worksheet.max_row + 1):
-                for col_idx in range(1, worksheet.max_column + 1):
-                    if row_idx <= num_header_rows or col_idx == 1:
-                        cell = worksheet.cell(row=row_idx, column=col_idx)
-                        if cell.font and cell.font.bold:
-                            cell.font = cell.font.copy(bold=False)
-    
-            # シートの全てのセルをループ処理
-            for row in range(1, end_row + 1):
-                for col in range(1, end_col + 1):
-                    cell = worksheet.cell(row=row, column=col)
-                    cell.alignment = center_alignment
+    # 最適解が得られたか確認
+    if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
+        # 最適解の各段の値を取得
+        num_people_assigned = int(solver.Value(varianceOfAppliedMaru))
+        preference_score = int(solver.Value(totalAppliedMaru))
+        result_matrix = collect_result_matrix(solver)
+        # 中断や制限時間で打ち切った解は、次に同じ入力で実行したときに改善できるよう保存しない
+        if cache_key is not None and status == cp_model.OPTIMAL:
+            store_cached_solution(cache_key, result_matrix, num_people_assigned, preference_score)
+            stats["cache"] = "stored"
+        if previous:
+            # 以前の勤務表から変わった勤務の数（輪番を除く）
+            num_changed = sum(
+                int(result_matrix[i - start_row][d - start_col] == 1) != int(previous_row[d - start_col] == 1)
+                for i, previous_row in previous.items() for d in range(start_col, end_col)
+                if not is_rinban[i, d])
+            add_notice(stats, f"以前の勤務表から変更した勤務: {num_changed}件")
+            stats["repair"] = {"num_changed": num_changed,
+                               "num_matched_people": len(previous),
+                               "num_frozen_people": None if repair_rows is None else len(previous) - len(repair_rows & set(previous))}
+        recorder.lap("collect_solution")
         
-        logging.info("Excelファイルへの書き込み完了")
-        # print(f"勤務表を'{output_filename}'に保存しました。")
-        return f"勤務表を'{output_filename}'に保存しました。"
+        # 別案: 同じモデルに「これまでのどの案からも alternative_distance セル以上変える」制約を足して解き直す
+        # 〇が採用された人数は最良の案と同じにし、その中で希望点の合計が大きい案から順に探す
+        alternatives = []
+        if num_alternatives:
+            model.Add(varianceOfAppliedMaru >= num_people_assigned)
+            model.Maximize(preference_objective)
+            best_values = {key: solver.Value(var) for key, var in x.items()}
+            last_values = best_values
+            stats["alternatives"] = []
+            for number in range(1, int(num_alternatives) + 1):
+                if stop_event is not None and stop_event.is_set():
+                    break
+                model.Add(cp_model.LinearExpr.Sum([
+                    1 - var if last_values[key] else var for key, var in x.items()
+                ]) >= int(alternative_distance))
+                # 別案も全体の制限時間（time_limit）の残りで解く。残りが無ければそこまでの別案を使う
+                alternative_time_limit = None
+                if time_limit is not None:
+                    alternative_time_limit = float(time_limit) - (time.perf_counter() - phase_start)
+                    if alternative_time_limit <= 0:
+                        break
+                alternative_solver = new_solver(alternative_time_limit)
+                alternative_start = time.perf_counter()
+                alternative_status, progress_callback = solve_with_progress(alternative_solver, len(stages) + number)
+                recorder.lap("solve:alternatives")
+                stats["alternatives"].append({
+                    "seconds": time.perf_counter() - alternative_start,
+                    **solver_response_stats(alternative_solver, progress_callback),
+                })
+                if alternative_status != cp_model.OPTIMAL and alternative_status != cp_model.FEASIBLE:
+                    break
+                last_values = {key: alternative_solver.Value(var) for key, var in x.items()}
+                alternatives.append({
+                    "result_matrix": collect_result_matrix(alternative_solver),
+                    "num_people_assigned": int(alternative_solver.Value(varianceOfAppliedMaru)),
+                    "preference_score": int(alternative_solver.Value(totalAppliedMaru)),
+                    # 最良の案から変わったセルの数
+                    "distance": sum(last_values[key] != value for key, value in best_values.items()),
+                })
+            logging.info(f"別案の作成完了: {len(alternatives)}件")
+        return {"status": stats["status"], "result_matrix": result_matrix,
+                "num_people_assigned": num_people_assigned, "preference_score": preference_score,
+                "alternatives": alternatives}
+    return {"status": stats["status"]}
+
+def describe_column(roster, d):
+    """列を「日にち（曜日と昼/夜）」の形の文字列にする（診断モード・勤務表の確認の表示に使う）"""
+    shift_type = roster["header_rows"][ROW_SHIFT_TYPE][d]
+    return f"{roster['date_numbers'][d]}日（{roster['weekdays'][d]}{shift_type or ''}）"
+
+def validate_schedule(file_path, schedule_path, rules=None, roster=None):
+    """出力した勤務表（手で入れ替えたものを含む）が、勤務希望とルールをすべて満たしているかを調べる
+
+    CpModelは作らず、solve_rosterと同じルールの列の組（collect_limited_groups）に対する配列の演算だけで確認する。
+    確認する条件: ×の日の勤務、必須勤務回数、各列の割り当て人数（割り当て不要の曜日を除き1人）、
+    勤務の間隔・連続勤務・前月データ・輪番の後のルール
+    file_path: 元の勤務希望のファイル（roster を渡したときは使わない）
+    schedule_path: 確認する勤務表（*_assigned_people*.xlsx の形式）
+    返り値: 違反のdict（rule: ルールの名前、name: 人の名前（列の違反はNone）、columns: 列のリスト、message）のリスト
+    """
+    if roster is None:
+        roster = load_roster(file_path)
+    start_row = roster["start_row"]
+    end_row = roster["end_row"]
+    start_col = roster["start_col"]
+    end_col = roster["end_col"]
+    names = roster["names"]
+    pref = roster["pref"]
+    rule_config = compile_rules(resolve_rules(rules, roster), roster)
+    is_rinban = pref == PREF_RINBAN
     
-    else:
-        # print("最適解が見つかりませんでした。")
-        logging.warning("最適解が見つかりませんでした。")
-        return "最適解が見つかりませんでした。"
+    # 勤務表の割り当て。輪番は勤務希望のとおり勤務ありとして数え、勤務回数と割り当て人数には数えない
+    schedule = np.zeros(pref.shape, dtype=np.int8)
+    for i, row in read_previous_schedule(schedule_path, roster).items():
+        schedule[i, start_col:end_col] = row
+    shifts = np.zeros(pref.shape, dtype=bool)
+    shifts[start_row:end_row, start_col:end_col] = (schedule == 1)[start_row:end_row, start_col:end_col]
+    shifts &= ~is_rinban
+    worked = shifts | is_rinban
+    
+    violations = []
+    def add(rule, i, columns, message):
+        violations.append({"rule": rule, "name": None if i is None else names[i],
+                           "columns": [int(d) for d in columns], "message": message})
+    
+    # ×の日の勤務
+    for i, d in np.argwhere(shifts & (pref == PREF_NG)).tolist():
+        add("ng", i, [d], f"{names[i]}: ×の日に勤務（{describe_column(roster, d)}）")
+    
+    # 必須勤務回数
+    counts = np.count_nonzero(shifts[start_row:end_row], axis=1)
+    required = np.array(roster["required_shifts"][start_row:end_row])
+    for k in np.flatnonzero(counts != required).tolist():
+        add("required_shifts", start_row + k, [],
+            f"{names[start_row + k]}: 勤務回数 {counts[k]}回（必須勤務回数 {required[k]}回）")
+    
+    # 各列の割り当て人数
+    column_counts = np.count_nonzero(shifts[start_row:end_row, start_col:end_col], axis=0)
+    is_covered = ~rule_config["is_exempt"][start_col:end_col]
+    for k in np.flatnonzero(is_covered & (column_counts != 1)).tolist():
+        d = start_col + k
+        add("coverage", None, [d], f"{describe_column(roster, d)}: 割り当て {column_counts[k]}人（1人必要）")
+    
+    # 勤務回数に上限がある列の組。ルールごとに (組, 列) の行列にして、組ごとの勤務回数を一度に数える
+    # 休息ルールのウィンドウは重なっているので、同じ勤務の組み合わせの違反は1回だけ表示する
+    for family, groups in collect_limited_groups(roster, rule_config).items():
+        if not groups:
+            continue
+        width = max(len(cols) for _, cols, _ in groups)
+        rows = np.array([i for i, _, _ in groups])
+        cols = np.full((len(groups), width), -1)
+        for k, (_, group_cols, _) in enumerate(groups):
+            cols[k, :len(group_cols)] = group_cols
+        limits = np.array([limit for _, _, limit in groups])
+        in_group = cols >= 0
+        worked_in_group = worked[rows[:, None], np.where(in_group, cols, 0)] & in_group
+        reported = set()
+        for k in np.flatnonzero(np.count_nonzero(worked_in_group, axis=1) > limits).tolist():
+            worked_cols = tuple(cols[k][worked_in_group[k]].tolist())
+            if (rows[k], worked_cols) in reported:
+                continue
+            reported.add((rows[k], worked_cols))
+            days_text = "・".join(describe_column(roster, d) for d in worked_cols)
+            add(family, int(rows[k]), worked_cols,
+                f"{names[rows[k]]}: {RULE_FAMILY_LABELS.get(family, family)}（{days_text}）")
+    return violations
+
+def max_spaced_shifts(counts, min_gap):
+    """日ごとに勤務できる回数（0なら勤務不可）から、別の日の勤務の間隔をmin_gap日以上あけるときの最大勤務回数を求める
+
+    期間分割モードで、区間より後の勤務回数の上限に使う（休息ルール以外の制約は見ないので、実際の最大値以上になる）
+    """
+    days = np.flatnonzero(counts)
+    best = [0]  # best[k]: 先頭からk日分の勤務できる日だけを使ったときの最大勤務回数
+    j = 0
+    for k, day in enumerate(days):
+        while days[j] <= day - min_gap:
+            j += 1
+        best.append(max(best[k], int(counts[day]) + best[j]))
+    return best[-1]
+
+def solve_horizon(roster, horizon_days, horizon_step, stats, on_progress=None, stop_event=None, time_limit=None,
+                  use_cache=True, stage_time_limits=None, num_workers=None, break_symmetry=False, rules=None,
+                  solver_parameters=None):
+    """期間を重なりのある区間に分けて順に解き、つなげた割り当て結果をdictで返す（期間分割モード）
+
+    1つの区間（horizon_days日分）ごとにモデルを作るため、時間とメモリは期間の長さにほぼ比例して増える。
+    各区間の解のうち先頭の horizon_step 日分を確定させ、次の区間は次のように作る:
+      - 直前の HORIZON_LOOKBACK_DAYS 日分は、確定した割り当てに固定したまま区間に含める
+        （区間の境目でも、まとめて解くときと同じ休息ルールが適用される）
+      - さらにその前の7日分を、確定した割り当てから作った前月データとして渡す
+      - 各人の必須勤務回数を、その人が勤務できる列（割り当て不要の曜日以外で×・輪番でない列）の数の割合で期間に配分し、
+        区間の終わりまでの累計の目安にする。目安から外れた回数は減点し（制約にはしない）、次の区間で調整される
+        勤務回数は必須勤務回数の残りを超えないようにし、最後の区間では残りちょうどにする
+      - 〇が既に採用された人は、人数の目的関数に数えない
+      - 区間の後ろの horizon_days 日分も、すべてのルールを適用した見通し用の列として区間に含め（確定はしない）、
+        それより後の期間は人ごとの勤務回数（勤務できる日と休息日数から求めた上限まで）と〇の回数だけで表す
+        （区間の中の割り当てが、後の区間を解けなくしたり〇を採用できなくしたりしないように）
+    区間の勤務表を作成できなかったときは、引き継いだ固定を外し、さらに前の区間の確定分も解き直すよう区間の始まりを
+    前に広げてやり直す。広げるのは HORIZON_RETRY_DAYS 日前までで（1つのモデルの大きさを期間の長さによらず抑えるため）、
+    それでも作成できなければ諦める。
+    期間全体の勤務表ができたら、horizon_days日の区間を半分ずつずらしながら、区間の外の割り当てをすべて固定して
+    解き直す（見直し）。
+    区間の外の勤務回数と〇が採用された人が確定しているので、区間の中では期間全体の目的関数をそのまま最大化でき、
+    改善がなくなるまで（最大 HORIZON_MAX_SWEEPS 回）繰り返す。
+    time_limit は全体の制限時間で、残り時間を残りの求解の回数で等分して使う。
+    返り値はsolve_rosterと同じ形で、区間が2つ以上ならstatusは "FEASIBLE"（最適性は証明しない）。
+    区間の勤務表を作成できなかったときは、その区間を failed_window（number, first_date, last_date）に入れて返す。
+    区間ごとの結果は stats["horizon"] に記録する
+    """
+    start_row = roster["start_row"]
+    end_row = roster["end_row"]
+    past_col = roster["past_col"]
+    start_col = roster["start_col"]
+    end_col = roster["end_col"]
+    date_numbers = roster["date_numbers"]
+    weekdays = roster["weekdays"]
+    pref = roster["pref"]
+    phase_start = time.perf_counter()
+    
+    rules = resolve_rules(rules, roster)
+    rule_config = compile_rules(rules, roster)
+    calendar = build_calendar_index(roster, rule_config)
+    # 列ごとの日の番号（日付の数字が変わるところで次の日になる）
+    day_of_column = calendar["day"]
+    month_days = day_of_column[start_col:end_col] - day_of_column[start_col]  # 当月の列の、期間の初日から何日目か
+    num_days = int(month_days[-1]) + 1
+    horizon_days = int(horizon_days)
+    horizon_step = int(horizon_step) if horizon_step is not None else max(horizon_days * 3 // 4, HORIZON_LOOKBACK_DAYS)
+    if not HORIZON_LOOKBACK_DAYS <= horizon_step <= horizon_days:
+        raise ValueError(f"期間分割モードの確定日数は{HORIZON_LOOKBACK_DAYS}日以上、区間の日数以下にしてください。")
+    num_windows = max(-(-(num_days - horizon_days) // horizon_step), 0) + 1
+    logging.info(f"期間分割モード: {num_days}日, 区間={horizon_days}日, 確定={horizon_step}日, 区間数={num_windows}")
+    
+    required = np.array(roster["required_shifts"][start_row:end_row])
+    # 各人が勤務できる列（割り当て不要の曜日以外で、×・輪番でない列）。必須勤務回数はこの列数の割合で区間に配分する
+    month_pref = pref[start_row:end_row, start_col:end_col]
+    is_covered = ~calendar["is_exempt"][start_col:end_col]  # 割り当てが必要な列
+    is_workable = (month_pref != PREF_NG) & (month_pref != PREF_RINBAN)
+    is_available = is_workable & is_covered
+    # 木曜に勤務できる回数（必須勤務回数の合計のうち、割り当てが必要な列数を上回る分）
+    uncovered_total = max(int(required.sum()) - int(np.count_nonzero(is_covered)), 0)
+    # 確定した割り当て（1:勤務、0:勤務なし、3:輪番）。当月の列だけを持つ
+    committed = np.zeros((end_row - start_row, end_col - start_col), dtype=np.int8)
+    
+    def horizon_score(matrix):
+        """期間全体の (〇が1つ以上採用された人数, 勤務になったセルの希望点の合計)"""
+        is_assigned = matrix == 1
+        return (int((is_assigned & (month_pref == PREF_MARU)).any(axis=1).sum()),
+                int(month_pref[is_assigned].astype(int).sum()))
+    
+    def build_window(first_day, last_day, review):
+        """first_day日目からlast_day日目の前日までを解く区間の勤務希望を作り、(区間のroster, 列のリスト) を返す
+
+        review: Falseなら first_day より前の確定した割り当てだけを使い、後ろの horizon_days 日分を見通し用の列として
+                区間に含める（順に解くとき）。
+                Trueなら区間の外の割り当てをすべて使い、後ろの HORIZON_LOOKBACK_DAYS 日分も固定して区間に含める（見直し）
+        """
+        lookback_day = max(first_day - HORIZON_LOOKBACK_DAYS, 0)
+        tail_day = min(last_day + (HORIZON_LOOKBACK_DAYS if review else horizon_days), num_days)
+        is_last = tail_day == num_days  # 期間の終わりまで区間に含まれるか
+        # 区間の列: 名前などの列、前月データの列、固定して引き継ぐ列と今回解く列（後ろの見通し用の列・固定する列も）
+        if first_day == 0:
+            past_cols = list(range(past_col, start_col))
+        else:
+            past_cols = [d for d in range(past_col, end_col)
+                         if lookback_day - 7 <= day_of_column[d] - day_of_column[start_col] < lookback_day]
+        window_cols = [d for d in range(start_col, end_col) if lookback_day <= month_days[d - start_col] < tail_day]
+        cols = list(range(past_col)) + past_cols + window_cols
+        window_start_col = past_col + len(past_cols)
+        
+        # 確定した割り当てを使う列（当月の列のうち）と、そのうち区間に含めない列
+        is_known = (month_days < first_day) | ((month_days >= last_day) if review else False)
+        is_outside = is_known & ((month_days < lookback_day) | (month_days >= tail_day))
+        window_pref = pref[:, cols]
+        fixed_cells = np.full(window_pref.shape, CELL_FREE, dtype=np.int8)
+        for j, d in enumerate(cols):
+            if d < start_col or not is_known[d - start_col]:
+                continue
+            assigned = committed[:, d - start_col]
+            if j < window_start_col:
+                # 前月データとして渡す列は、確定した勤務を〇に置き換える
+                window_pref[start_row:end_row, j] = np.select(
+                    [assigned == 1, assigned == PREF_RINBAN], [PREF_MARU, PREF_RINBAN], PREF_BLANK)
+            else:
+                fixed_cells[start_row:end_row, j] = np.minimum(assigned, 1)  # 輪番は勤務ありとして固定
+        
+        is_shift = committed == 1
+        outside = np.count_nonzero(is_shift[:, is_outside], axis=1)  # 区間に含めない列での勤務回数
+        carried = np.count_nonzero(is_shift[:, is_known & ~is_outside], axis=1)  # 固定して区間に含める勤務回数
+        required_shifts = list(roster["required_shifts"])
+        required_shifts_max = list(roster["required_shifts"])
+        required_shifts_target = None
+        if review:
+            # 区間の外がすべて確定しているので、区間の勤務回数は必須勤務回数の残りちょうど
+            for i in range(start_row, end_row):
+                required_shifts[i] = required_shifts_max[i] = int(required[i - start_row] - outside[i - start_row])
+        else:
+            # 区間ごとの勤務回数: 必須勤務回数の残りを上限とし、区間の終わりまでの累計の目安を各人の勤務できる列数の割合で決める
+            done = outside + carried
+            remaining = np.maximum(required - done, 0)
+            target = required * np.count_nonzero(is_available[:, month_days < last_day], axis=1) / np.maximum(
+                np.count_nonzero(is_available, axis=1), 1)
+            target_low = np.clip(np.floor(target) - done, 0, remaining)
+            target_high = np.clip(np.ceil(target) - done, 0, remaining)
+            required_shifts_target = [None] * len(required_shifts)
+            for i in range(start_row, end_row):
+                k = i - start_row
+                required_shifts[i] = int((remaining[k] if is_last else 0) + carried[k])
+                required_shifts_max[i] = int(remaining[k] + carried[k])
+                required_shifts_target[i] = (int(target_low[k] + carried[k]), int(target_high[k] + carried[k]))
+        future = None
+        if not review and not is_last:
+            # 見通し用の列より後の期間の概要。
+            # 人ごとに、見通し用の列より後の勤務できる日・〇の日と休息日数から、勤務回数の上限を求める
+            is_future = month_days >= tail_day
+            future = {"capacity": [0] * len(required_shifts), "maru_capacity": [0] * len(required_shifts),
+                      "columns": int(np.count_nonzero(is_covered & is_future)),
+                      "maru_columns": int(np.count_nonzero((month_pref[:, is_future] == PREF_MARU).any(axis=0)))}
+            min_rest = min(rule_config["night_rest_days"], rule_config["day_rest_days"])
+            for i in range(start_row, end_row):
+                k = i - start_row
+                workable = np.bincount(month_days[is_future & is_workable[k]], minlength=num_days)
+                maru = np.bincount(month_days[is_future & (month_pref[k] == PREF_MARU)], minlength=num_days)
+                if rule_config["applies"]["day_night_pair"][i]:
+                    # 同じ日の昼夜の勤務は、両方に〇があるときだけ
+                    workable = np.where(maru >= 2, workable, np.minimum(workable, 1))
+                gap = min_rest if rule_config["applies"]["rest_window"][i] else 1
+                future["capacity"][i] = max_spaced_shifts(workable, gap)
+                future["maru_capacity"][i] = max_spaced_shifts(maru, gap)
+        uncovered_used = np.count_nonzero(is_shift[:, ~is_covered & is_outside])
+        assigned_rows = (np.flatnonzero((is_shift[:, is_known] & (month_pref[:, is_known] == PREF_MARU)).any(axis=1))
+                         + start_row).tolist()
+        
+        window_roster = {
+            "start_row": start_row,
+            "end_row": end_row,
+            "past_col": past_col,
+            "start_col": window_start_col,
+            "end_col": len(cols),
+            "names": roster["names"],
+            "required_shifts": required_shifts,
+            "required_shifts_max": required_shifts_max,
+            "required_shifts_target": required_shifts_target,
+            "max_uncovered_shifts": uncovered_total - int(uncovered_used),
+            "assigned_rows": assigned_rows,
+            "future": future,
+            "weekdays": [weekdays[d] for d in cols],
+            "date_numbers": [date_numbers[d] for d in cols],
+            "is_night": [roster["is_night"][d] for d in cols],
+            "header_rows": [[row[d] for d in cols] for row in roster["header_rows"]],
+            "pref": window_pref,
+            "fixed_cells": fixed_cells,
+        }
+        return window_roster, window_cols
+    
+    # 見直しの区間は、区間の日数の半分ずつずらして並べる（順に解いた区間の境目をまたぐ入れ替えも見直せるように）
+    review_windows = []
+    if num_windows > 1:
+        first_day = 0
+        while not review_windows or review_windows[-1][1] < num_days:
+            review_windows.append((first_day, min(first_day + horizon_days, num_days)))
+            first_day += horizon_days // 2
+    # 求解の回数の目安（順に解く区間と見直しの区間）。制限時間の配分に使う
+    planned_solves = num_windows + HORIZON_MAX_SWEEPS * len(review_windows)
+    stats["horizon"] = []
+    stats["solve_seconds"] = 0.0
+    stats["build_seconds"] = 0.0
+    
+    def solve_window(window, first_day, last_day, review, kind):
+        """区間を1つ解いて stats["horizon"] に記録し、(solve_rosterの返り値, 区間の当月の列のリスト) を返す"""
+        window_roster, window_cols = build_window(first_day, last_day, review)
+        window_count = len(review_windows) if review else num_windows
+        window_progress = None
+        if on_progress is not None:
+            def window_progress(progress):
+                on_progress({**progress, "window": window + 1, "num_windows": window_count})
+        window_time_limit = None
+        if time_limit is not None:
+            elapsed = time.perf_counter() - phase_start
+            window_time_limit = max(float(time_limit) - elapsed, 0.0) / max(planned_solves - len(stats["horizon"]), 1)
+        previous = None
+        if review:
+            # 今の割り当てをヒントにする（勤務回数などの制約を満たしているので、見直しの区間で必ず解がある）
+            previous = {i: committed[i - start_row, [d - start_col for d in window_cols]] for i in range(start_row, end_row)}
+        window_stats = {}
+        solution = solve_roster(window_roster, window_stats, PhaseRecorder(window_stats), on_progress=window_progress,
+                                stop_event=stop_event, time_limit=window_time_limit, use_cache=use_cache,
+                                previous=previous, stage_time_limits=stage_time_limits, num_workers=num_workers,
+                                break_symmetry=break_symmetry, rules=rules, solver_parameters=solver_parameters)
+        first_date = date_numbers[next(d for d in window_cols if month_days[d - start_col] >= first_day)]
+        last_date = date_numbers[max(d for d in window_cols if month_days[d - start_col] < last_day)]
+        logging.info(f"区間{window + 1}/{window_count}（{first_date}日〜{last_date}日, {kind}）の実行完了. "
+                     f"ステータス: {solution['status']}")
+        stats["horizon"].append({
+            "window": window + 1,
+            "kind": kind,
+            "first_date": first_date,
+            "last_date": last_date,
+            "status": solution["status"],
+            "cache": window_stats.get("cache"),
+            "num_variables": window_stats.get("num_variables"),
+            "num_constraints": window_stats.get("num_constraints"),
+            "build_seconds": window_stats.get("build_seconds"),
+            "solve_seconds": window_stats.get("solve_seconds"),
+        })
+        stats["build_seconds"] += window_stats.get("build_seconds") or 0.0
+        stats["solve_seconds"] += window_stats.get("solve_seconds") or 0.0
+        return solution, window_cols
+    
+    def apply_solution(solution, window_cols, first_day, last_day, target):
+        """区間の解のうち first_day日目からlast_day日目の前日までの割り当てを target（当月の列の行列）に書き込む"""
+        result_matrix = np.asarray(solution["result_matrix"], dtype=np.int8)
+        for j, d in enumerate(window_cols):
+            if first_day <= month_days[d - start_col] < last_day:
+                target[:, d - start_col] = result_matrix[:, j]
+    
+    # 順に解く: 区間の先頭（最後の区間なら全体）の割り当てを確定させる
+    statuses = []
+    for window in range(num_windows):
+        first_day = window * horizon_step
+        last_day = min(first_day + horizon_days, num_days)  # この日は含まない
+        solution, window_cols = solve_window(window, first_day, last_day, False, "forward")
+        # 作成できなければ、引き継いだ固定を外し（区間を HORIZON_LOOKBACK_DAYS 日前から始め）、
+        # それでも作成できなければ前の区間の確定分も含めるよう、区間の始まりを HORIZON_RETRY_DAYS 日前まで広げてやり直す
+        retry_day = first_day
+        retry_limit = max(first_day - HORIZON_RETRY_DAYS, 0)
+        while solution["status"] not in ("OPTIMAL", "FEASIBLE") and retry_day > retry_limit and not (
+                stop_event is not None and stop_event.is_set()):
+            retry_day = max(retry_day - (HORIZON_LOOKBACK_DAYS if retry_day == first_day else horizon_step), retry_limit)
+            logging.info(f"区間{window + 1}/{num_windows}の勤務表を作成できなかったため、"
+                         f"区間を期間の{retry_day + 1}日目からに広げてやり直します。")
+            solution, window_cols = solve_window(window, retry_day, last_day, False, "retry")
+        statuses.append(solution["status"])
+        if solution["status"] not in ("OPTIMAL", "FEASIBLE"):
+            first_date = date_numbers[next(d for d in range(start_col, end_col) if month_days[d - start_col] >= first_day)]
+            last_date = date_numbers[max(d for d in range(start_col, end_col) if month_days[d - start_col] < last_day)]
+            widened = f"、区間を{first_day - retry_day}日前まで広げても" if retry_day < first_day else ""
+            logging.warning(f"区間{window + 1}/{num_windows}（{first_date}日〜{last_date}日）の勤務表を"
+                            f"{widened}作成できませんでした。")
+            stats["status"] = solution["status"]
+            return {"status": solution["status"],
+                    "failed_window": {"number": window + 1, "first_date": first_date, "last_date": last_date}}
+        apply_solution(solution, window_cols, retry_day, last_day if last_day == num_days else first_day + horizon_step,
+                       committed)
+    
+    # 見直し: 区間の外をすべて固定して解き直し、期間全体のスコアが上がった区間だけ採用する
+    score = horizon_score(committed)
+    for sweep in range(HORIZON_MAX_SWEEPS if review_windows else 0):
+        improved = False
+        for window, (first_day, last_day) in enumerate(review_windows):
+            if stop_event is not None and stop_event.is_set():
+                break
+            solution, window_cols = solve_window(window, first_day, last_day, True, f"review{sweep + 1}")
+            if solution["status"] not in ("OPTIMAL", "FEASIBLE"):
+                continue
+            candidate = committed.copy()
+            apply_solution(solution, window_cols, first_day, last_day, candidate)
+            candidate_score = horizon_score(candidate)
+            if candidate_score > score:
+                committed, score, improved = candidate, candidate_score, True
+        logging.info(f"期間分割モードの見直し{sweep + 1}回目: 人数={score[0]}, 希望点={score[1]}")
+        if not improved:
+            break
+    
+    stats["num_people"] = end_row - start_row
+    stats["num_columns"] = end_col - start_col
+    stats["num_variables"] = max(entry["num_variables"] or 0 for entry in stats["horizon"])
+    stats["num_constraints"] = max(entry["num_constraints"] or 0 for entry in stats["horizon"])
+    # 区間に分けて解いた結果は、区間ごとに最適でも期間全体で最適とは限らない（区間が1つならまとめて解いたのと同じ）
+    stats["status"] = statuses[0] if num_windows == 1 else "FEASIBLE"
+    # スコアは期間全体で数え直す（〇が1つ以上採用された人数と、勤務になったセルの希望点の合計）
+    return {
+        "status": stats["status"],
+        "result_matrix": committed.tolist(),
+        "num_people_assigned": score[0],
+        "preference_score": score[1],
+    }
+
+def write_schedule_result(file_path, roster, result_matrix, num_people_assigned, preference_score,
+                          stats, recorder, phase_start, suffix=""):
+    """割り当て結果を入力ファイルと同じフォルダのExcelに書き出し、スコアの内訳と保存先を結果のメッセージとして返す
+
+    result_matrix: 勤務希望の範囲（start_row〜, start_col〜）の割り当て結果。1:勤務、0:勤務なし、3:輪番
+    num_people_assigned, preference_score: 〇が1つ以上採用された人数（1段目の値）と希望点の合計（2段目の値）
+    suffix: 出力ファイル名の末尾に付ける文字列（別案の "_alt1" など）
+    """
+    start_row = roster["start_row"]
+    end_row = roster["end_row"]
+    start_col = roster["start_col"]
+    end_col = roster["end_col"]
+    names = roster["names"]
+    # --- 「〇」希望を出した人数の計算 ---
+    # 各行に〇が1つ以上含まれるか（any(axis=1)）を判定し、
+    # Trueの行を合計（sum()）する
+    num_rows_with_2 = int((roster["pref"][start_row:end_row, start_col:end_col] == PREF_MARU).any(axis=1).sum())
+    logging.info(f"「〇」の希望を1つ以上出している人数: {num_rows_with_2}人")
+    # --- ここまで ---
+    # 人数と希望点の合計は別々の目的関数なので、1つのスコアにまとめずに別々に表示する
+    stats["num_people_assigned"] = num_people_assigned
+    stats["preference_score"] = preference_score
+
+    # f-string内で改行文字 \n を使うことで、出力を複数行に分割（結果のメッセージの先頭に付ける）
+    summary = (f"結果:\n"
+               f"  - 〇を一つ以上記載した人数: {num_rows_with_2}人\n"
+               f"  - 〇を一つ以上採用した人数: {num_people_assigned}人（1段目）\n"
+               f"  - 〇の採用スコア: {preference_score}（2段目）")
+
+    # 元データのヘッダー（曜日・日付など4行）の下に、〇（勤務）・空白・輪番の表記で結果を並べる
+    header_rows = [
+        ['' if val is None else val for val in row[start_col:end_col]] for row in roster["header_rows"]]
+    display_rows = header_rows + [
+        [{1: "〇", 0: "", 3: "輪番"}.get(int(val), val) for val in row] for row in result_matrix]
+    display_names = names[:len(header_rows)] + names[start_row:end_row]
+    recorder.lap("excel:build_rows")
+
+    # 出力ファイル名を動的に生成
+    # 入力ファイルと同じディレクトリに出力ファイルを作成
+    output_dir = os.path.dirname(file_path)
+    # 〇を採用した人数と〇の採用スコアをファイル名に含める
+    base_filename = os.path.splitext(os.path.basename(file_path))[0]
+    output_filename = os.path.join(
+        output_dir, f"{base_filename}_assigned_people{num_people_assigned}_pref{preference_score}{suffix}.xlsx")
+
+    logging.info(f"結果をExcelファイルに書き込み開始: {output_filename}")
+    write_schedule_excel(output_filename, display_names, display_rows, header_rows[ROW_WEEKDAY], end_col)
+    recorder.lap("excel:write")
+    
+    logging.info("Excelファイルへの書き込み完了")
+    stats["write_seconds"] = time.perf_counter() - phase_start
+    stats["output_file"] = output_filename
+    write_stats_sidecar(os.path.splitext(output_filename)[0] + ".stats.json", stats)
+    # print(f"勤務表を'{output_filename}'に保存しました。")
+    return f"{summary}\n勤務表を'{output_filename}'に保存しました。"
+
+_worker_output_lock = threading.Lock()
+
+def write_worker_message(stream, message):
+    """ワーカーの応答を1行のJSONとして書き出す（ソルバーのスレッドからも呼ばれる）"""
+    with _worker_output_lock:
+        stream.write(json.dumps(message, ensure_ascii=False) + "\n")
+        stream.flush()
+
+def run_worker():
+    """常駐ワーカーモード。ライブラリを読み込んだまま、標準入力からのリクエストを順に処理する
+
+    リクエストは1行1件のJSON: {"id": ..., "file_path": "...", "options": {...}}
+    実行中の探索の停止要求: {"type": "stop"}
+    応答も1行1件のJSON:
+      途中経過 {"id": ..., "type": "progress", "stage": ..., "num_people_assigned": ..., "preference_score": ..., "elapsed": ...}
+      結果     {"id": ..., "type": "result", "success": true/false, "message": "...",
+                "num_people_assigned": ..., "preference_score": ...}（人数・希望点は勤務表を作成できたときだけ値が入る）
+    create_scheduleは結果と注意をmessageとして返し、標準出力には書かない（念のため、処理中のprintもmessageにまとめる）。
+    標準出力にはJSON以外を書かない。
+    """
+    protocol_out = sys.stdout
+    stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    pending_lines = queue.Queue()
+    stop_event = threading.Event()
+
+    def read_requests():
+        # 探索中でも停止要求を受け取れるよう、標準入力は別スレッドで読む
+        for line in stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                message = None
+            if isinstance(message, dict) and message.get("type") == "stop":
+                stop_event.set()
+            else:
+                pending_lines.put(line)
+        pending_lines.put(None)
+
+    threading.Thread(target=read_requests, daemon=True).start()
+    logging.info("ワーカーモードで起動しました。")
+    while True:
+        line = pending_lines.get()
+        if line is None:
+            break
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            stop_event.clear()  # 前のリクエストに対する停止要求は持ち越さない
+
+            def send_progress(progress):
+                write_worker_message(protocol_out, {"id": request_id, "type": "progress", **progress})
+
+            stats = {}
+            captured = io.StringIO()
+            with contextlib.redirect_stdout(captured):
+                result_message = create_schedule(request["file_path"], on_progress=send_progress,
+                                                 stop_event=stop_event, stats=stats, **request.get("options", {}))
+            write_worker_message(protocol_out, {
+                "id": request_id,
+                "type": "result",
+                "success": True,
+                "message": captured.getvalue() + result_message + "\n",
+                "num_people_assigned": stats.get("num_people_assigned"),
+                "preference_score": stats.get("preference_score"),
+            })
+        except Exception as e:
+            # 1件の失敗でワーカーを止めず、エラーを応答として返す
+            logging.critical(f"ワーカーでの処理中にエラーが発生しました: {e}")
+            logging.critical(traceback.format_exc())
+            write_worker_message(protocol_out, {
+                "id": request_id,
+                "type": "result",
+                "success": False,
+                "message": f"An unexpected error occurred: {e}",
+            })
+    logging.info("標準入力が閉じられたため、ワーカーを終了します。")
+
+# バッチモードの結果ファイルの列
+BATCH_SUMMARY_FIELDS = [
+    "file", "status", "num_people_assigned", "preference_score",
+    "total_seconds", "solve_seconds", "num_workers", "output_file", "message",
+]
+
+def collect_batch_files(patterns):
+    """フォルダ名またはglobのパターンから、入力Excelファイルの一覧を作る
+
+    出力ファイル（*_assigned_people*.xlsx と以前の形式の *_assigned_score*.xlsx）とExcelの一時ファイル（~$*.xlsx）は除く。
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*.xlsx")
+        for path in sorted(glob.glob(pattern)):
+            name = os.path.basename(path)
+            if "_assigned_people" in name or "_assigned_score" in name or name.startswith("~$") or path in files:
+                continue
+            files.append(path)
+    return files
+
+def split_cpu_cores(num_files, jobs=None, cpu_count=None):
+    """同時に解くファイル数（プロセス数）と、各CP-SATの探索スレッド数を決める
+
+    jobsを省略すると、1つのCP-SATに4スレッド以上割り当てられる範囲でプロセスを増やす。
+    返り値: (プロセス数, 1プロセスあたりの探索スレッド数)
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    if jobs is None:
+        jobs = max(1, cpu_count // 4)
+    jobs = max(1, min(jobs, num_files, cpu_count))
+    return jobs, max(1, cpu_count // jobs)
+
+def _init_batch_worker():
+    """バッチモードの子プロセスの初期化。ログは1つのファイルに追記し、プロセス名を付ける"""
+    setup_logging(file_mode='a', log_format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s')
+
+def solve_batch_item(file_path, options):
+    """バッチモードで1つのファイルを解き、結果の概要をdictで返す（子プロセスで実行される）"""
+    stats = {}
+    start = time.perf_counter()
+    captured = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(captured):
+            result_message = create_schedule(file_path, stats=stats, **options)
+        status = stats.get("status", "UNKNOWN")
+    except Exception as e:
+        logging.critical(f"バッチモードでの処理中にエラーが発生しました: {file_path}, Error: {e}")
+        logging.critical(traceback.format_exc())
+        status = "ERROR"
+        result_message = f"An unexpected error occurred: {e}"
+    return {
+        "file": file_path,
+        "status": status,
+        "num_people_assigned": stats.get("num_people_assigned"),
+        "preference_score": stats.get("preference_score"),
+        "total_seconds": time.perf_counter() - start,
+        "solve_seconds": stats.get("solve_seconds"),
+        "num_workers": options.get("num_workers"),
+        "output_file": stats.get("output_file"),
+        "message": (captured.getvalue() + result_message).strip(),
+    }
+
+def run_batch(patterns, jobs=None, summary_prefix="batch_summary", **options):
+    """複数の勤務希望ファイルをプロセスプールで並行して解き、ファイルごとの結果の一覧をCSV/JSONに書き出す
+
+    options: create_scheduleに渡す引数（time_limitなど）
+    返り値: ファイルごとの結果のdictのリスト（入力ファイルの順）
+    """
+    files = collect_batch_files(patterns)
+    if not files:
+        print("入力ファイルが見つかりませんでした。")
+        return []
+    jobs, num_workers = split_cpu_cores(len(files), jobs)
+    options = dict(options, num_workers=num_workers)
+    logging.info(f"バッチモード: {len(files)}ファイル, プロセス数={jobs}, 探索スレッド数={num_workers}")
+    print(f"{len(files)}個のファイルを {jobs}プロセス × 探索{num_workers}スレッド で解きます。", flush=True)
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker) as executor:
+        futures = {executor.submit(solve_batch_item, path, options): path for path in files}
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results[result["file"]] = result
+            print(f"[{len(results)}/{len(files)}] {result['file']}: {result['status']}"
+                  f" 人数={result['num_people_assigned']} 希望点={result['preference_score']}"
+                  f" ({result['total_seconds']:.1f}秒)", flush=True)
+    results = [results[path] for path in files]
+    with open(summary_prefix + ".csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=BATCH_SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+    with open(summary_prefix + ".json", "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"結果の一覧を {summary_prefix}.csv / {summary_prefix}.json に保存しました。")
+    return results
 
 if __name__ == "__main__":
+    # PyInstallerで固めたexeをWindows（spawn）で実行したとき、バッチモードの子プロセスが
+    # exeの先頭から実行し直さずにワーカー関数だけを実行するよう、最初に呼ぶ
+    multiprocessing.freeze_support()
     # スクリプト実行の最初にログ設定を呼び出す
     setup_logging()
 
+    parser = argparse.ArgumentParser(description="当直表を自動作成する")
+    parser.add_argument("file_path", nargs="?", help="入力ファイルのパス（Excel、またはCSV・JSON・.npz）")
+    parser.add_argument("--worker", action="store_true",
+                        help="常駐ワーカーとして起動し、標準入力のJSONリクエストを処理する")
+    parser.add_argument("--batch", nargs="+", metavar="DIR_OR_GLOB",
+                        help="フォルダまたはglobで指定した複数のファイルを並行して解く")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="バッチモードで同時に解くファイル数（省略時はCPUのコア数から決める）")
+    parser.add_argument("--summary", default="batch_summary",
+                        help="バッチモードの結果一覧の出力先（拡張子なし）")
+    parser.add_argument("--progress", action="store_true",
+                        help="改善解が見つかるたびに途中経過をJSON行で標準出力に書き出す")
+    parser.add_argument("--time-limit", type=float, default=None,
+                        help="探索全体の制限時間（秒）")
+    parser.add_argument("--stage-time-limits", type=float, nargs=2, metavar=("PEOPLE", "PREFERENCE"),
+                        help="1段目（〇を採用する人数）と2段目（希望点の合計）それぞれの制限時間（秒）")
+    parser.add_argument("--diagnose", action="store_true",
+                        help="勤務表は作らず、条件が矛盾していないかを調べる")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="保存済みの解を使わず、必ず求解し直す")
+    parser.add_argument("--previous", metavar="XLSX",
+                        help="修正モード: 以前に出力した勤務表の割り当てをもとに解き直す")
+    parser.add_argument("--deviation-weight", type=int, default=None,
+                        help=f"修正モード: 以前の勤務表から変更した勤務1件ごとの減点（既定: {REPAIR_DEVIATION_WEIGHT}）。"
+                             "0にすると以前の勤務表はヒントになるだけで、変更は減らさない")
+    parser.add_argument("--repair-people", nargs="+", metavar="NAME",
+                        help="修正モード: 割り当てを変えてよい人の名前。それ以外の人は以前の勤務表のまま固定する")
+    parser.add_argument("--alternatives", type=int, default=0, metavar="K",
+                        help="最良の勤務表に加えて、〇を採用する人数が同じで割り当てが異なる別案をK件作る")
+    parser.add_argument("--alternative-distance", type=int, default=ALTERNATIVE_MIN_DISTANCE, metavar="CELLS",
+                        help="別案どうしで最低限変えるセルの数")
+    parser.add_argument("--break-symmetry", action="store_true",
+                        help="条件がすべて同じ人どうしの割り当ての入れ替えを除く制約を加える（古いOR-Tools向け）")
+    parser.add_argument("--solver-profile", choices=list(SOLVER_PROFILES), default=None,
+                        help="ソルバーの設定の組: draft（速い下書き）, balanced（バランス、既定）, optimal（最適性の証明）")
+    parser.add_argument("--solver-param", action="append", default=[], metavar="NAME=VALUE",
+                        help="CP-SATのパラメータを個別に上書きする（例: log_search_progress=true）。複数回指定できる")
+    parser.add_argument("--validate", metavar="XLSX",
+                        help="勤務表は作らず、出力した勤務表（手で修正したもの）が勤務希望とルールを満たしているかを調べる")
+    parser.add_argument("--export-model", metavar="NPZ",
+                        help="作成したモデル・変数の対応・ソルバーのパラメータを書き出す（--replay で解き直せる）")
+    parser.add_argument("--replay", metavar="NPZ",
+                        help="--export-model で書き出したモデルを、Excelを読まずにそのまま解き直す")
+    parser.add_argument("--rules", metavar="JSON",
+                        help="ルールの設定（休息日数・割り当て不要の曜日・個人の例外）のJSONファイル")
+    parser.add_argument("--horizon-days", type=int, default=None, metavar="DAYS",
+                        help="期間分割モード: 長い期間をこの日数ずつの区間に分けて順に解く")
+    parser.add_argument("--horizon-step", type=int, default=None, metavar="DAYS",
+                        help="期間分割モード: 1つの区間から確定させる日数（省略時は区間の日数の3/4）")
+    args = parser.parse_args()
+
+    def parse_solver_params(items):
+        # NAME=VALUE の VALUE はJSONとして読む（true, 8, 0.5 など）。読めなければ文字列のまま
+        params = {}
+        for item in items:
+            name, separator, value = item.partition("=")
+            if not separator:
+                parser.error(f"--solver-param は NAME=VALUE の形で指定してください: {item}")
+            try:
+                params[name.strip()] = json.loads(value)
+            except ValueError:
+                params[name.strip()] = value
+        return params
+    solver_params = parse_solver_params(args.solver_param)
+
     try:
+        if args.worker:
+            run_worker()
+        elif args.batch:
+            run_batch(args.batch, jobs=args.jobs, summary_prefix=args.summary, time_limit=args.time_limit,
+                      stage_time_limits=args.stage_time_limits, use_cache=not args.no_cache,
+                      break_symmetry=args.break_symmetry, rules=args.rules,
+                      solver_profile=args.solver_profile, solver_params=solver_params,
+                      horizon_days=args.horizon_days, horizon_step=args.horizon_step)
+        elif args.replay:
+            replay_stats = {}
+            replay = replay_model(args.replay, time_limit=args.time_limit, solver_params=solver_params,
+                                  stats=replay_stats)
+            recorded = replay["meta"].get("recorded") or []
+            print(f"{replay['meta'].get('input_file')}（OR-Tools {replay['meta'].get('ortools_version')} で書き出し"
+                  f" → {ortools.__version__} で再実行）")
+            for stage, result in enumerate(replay["stages"]):
+                line = (f"{stage + 1}段目（{result['name']}）: {result['status']}, 目的関数 {result['objective']:g}"
+                        f" / 上限 {result['best_objective_bound']:g}, {result['seconds']:.2f}秒")
+                if stage < len(recorded):
+                    line += f"（書き出したとき: {recorded[stage]['status']}, {recorded[stage]['seconds']:.2f}秒）"
+                print(line)
+            write_stats_sidecar(os.path.splitext(args.replay)[0] + ".replay.json", replay_stats)
         # コマンドライン引数からファイルパスを取得
-        if len(sys.argv) > 1:
-            file_path_arg = sys.argv[1]
+        elif args.file_path and args.validate:
+            start = time.perf_counter()
+            violations = validate_schedule(args.file_path, args.validate, rules=args.rules)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if violations:
+                print(f"{len(violations)}件の違反が見つかりました（{elapsed_ms:.0f}ミリ秒）:")
+                for violation in violations:
+                    print(f"  - {violation['message']}")
+                sys.exit(2)
+            print(f"違反は見つかりませんでした（{elapsed_ms:.0f}ミリ秒）。")
+        elif args.file_path:
             # 処理を実行して結果を標準出力に出力
-            result_message = create_schedule(file_path_arg)
+            on_progress = None
+            if args.progress:
+                def on_progress(progress):
+                    print(json.dumps({"type": "progress", **progress}, ensure_ascii=False), flush=True)
+            result_message = create_schedule(args.file_path, on_progress=on_progress, use_cache=not args.no_cache,
+                                             previous_schedule=args.previous, deviation_weight=args.deviation_weight,
+                                             repair_people=args.repair_people, time_limit=args.time_limit,
+                                             stage_time_limits=args.stage_time_limits, diagnose=args.diagnose,
+                                             horizon_days=args.horizon_days, horizon_step=args.horizon_step,
+                                             num_alternatives=args.alternatives,
+                                             alternative_distance=args.alternative_distance,
+                                             break_symmetry=args.break_symmetry, rules=args.rules,
+                                             solver_profile=args.solver_profile, solver_params=solver_params,
+                                             export_model=args.export_model)
             print(result_message)
         else:
             logging.error("コマンドライン引数にファイルパスが指定されていません。")
@@ -8,6 +8,120 @@ const path = require('path');
 const isDev = !app.isPackaged; // アプリがパッケージ化されているかで開発環境かを判断
 let mainWindow; // ウィンドウオブジェクトをスコープ外で参照できるようにする
 
+// 常駐するPythonワーカー（dutyAssign.py --worker）。1行1件のJSONでやり取りする
+let pythonWorker = null;
+let nextRequestId = 1;
+const pendingRequests = new Map(); // リクエストID -> { resolve, onProgress }
+// エラーメッセージに付ける標準エラー出力の最大文字数（末尾だけを残す）
+const MAX_STDERR_LENGTH = 4096;
+
+function startPythonWorker() {
+    // 開発時はvenvのPythonを、本番時はPyInstallerのexeを使用
+    const scriptPath = path.join(__dirname, 'dutyAssign.py');
+    const venvPython = path.join(__dirname, '.venv', 'Scripts', 'python.exe');
+    const packagedExe = path.join(process.resourcesPath, 'app', 'dutyAssign.exe');
+
+    const command = isDev ? venvPython : packagedExe;
+    const args = isDev ? [scriptPath, '--worker'] : ['--worker'];
+    const worker = spawn(command, args, { encoding: 'utf8' });
+    // 複数バイト文字がチャンクの境目で分割されても正しく復元されるよう、文字列として受け取る
+    worker.stdout.setEncoding('utf8');
+
+    let buffer = '';
+    // 標準エラー出力は処理中のリクエストの分だけを持つ（runInPythonWorkerでリクエストごとに空にする）
+    worker.stderrText = '';
+    const withStderr = (message) => (worker.stderrText ? `${message}\n${worker.stderrText}` : message);
+
+    // 未完了のリクエストをすべて失敗として返す
+    const rejectPending = (message) => {
+        for (const { resolve } of pendingRequests.values()) {
+            resolve({ success: false, message });
+        }
+        pendingRequests.clear();
+    };
+
+    // spawn自体が失敗した場合のエラーハンドリング (例: コマンドが見つからない)
+    worker.on('error', (err) => {
+        if (pythonWorker === worker) {
+            pythonWorker = null;
+        }
+        rejectPending(`Failed to start Python script: ${err.message}`);
+    });
+
+    // Pythonからの標準出力を1行ずつJSONとして解釈する
+    worker.stdout.on('data', (data) => {
+        buffer += data;
+        let newlineIndex;
+        while ((newlineIndex = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newlineIndex).trim();
+            buffer = buffer.slice(newlineIndex + 1);
+            if (!line) {
+                continue;
+            }
+            let response;
+            try {
+                response = JSON.parse(line);
+            } catch (e) {
+                console.log('Python worker output:', line);
+                continue;
+            }
+            const pending = pendingRequests.get(response.id);
+            if (!pending) {
+                continue;
+            }
+            if (response.type === 'progress') {
+                // 改善解が見つかるたびに途中経過を通知する
+                pending.onProgress(response);
+            } else {
+                pendingRequests.delete(response.id);
+                pending.resolve({
+                    success: response.success,
+                    message: response.success ? response.message : withStderr(response.message),
+                });
+            }
+        }
+    });
+
+    // Pythonからの標準エラー出力を受け取る
+    worker.stderr.on('data', (data) => {
+        worker.stderrText = (worker.stderrText + data.toString()).slice(-MAX_STDERR_LENGTH);
+    });
+
+    // ワーカーが終了した場合は、次のリクエストで起動し直す
+    worker.on('close', (code) => {
+        if (pythonWorker === worker) {
+            pythonWorker = null;
+        }
+        rejectPending(withStderr(`Python script exited with code ${code}:`));
+    });
+
+    return worker;
+}
+
+function getPythonWorker() {
+    if (!pythonWorker) {
+        pythonWorker = startPythonWorker();
+    }
+    return pythonWorker;
+}
+
+function runInPythonWorker(filePath, options = {}, onProgress = () => {}) {
+    const worker = getPythonWorker();
+    const id = nextRequestId++;
+    return new Promise((resolve) => {
+        pendingRequests.set(id, { resolve, onProgress });
+        worker.stderrText = '';
+        worker.stdin.write(JSON.stringify({ id, file_path: filePath, options }) + '\n');
+    });
+}
+
+// 実行中の探索を打ち切り、それまでの最良解を書き出させる
+function stopPythonWorkerSearch() {
+    if (pythonWorker) {
+        pythonWorker.stdin.write(JSON.stringify({ type: 'stop' }) + '\n');
+    }
+}
+
 function createWindow() {
     mainWindow = new BrowserWindow({
         width: 400,
@@ -29,47 +143,27 @@ function createWindow() {
     });
 
     // レンダラープロセスから 'run-python-script' イベントを受け取る
-    ipcMain.handle('run-python-script', async (event, filePath) => {
- 
-        // 開発時はvenvのPythonを、本番時はPyInstallerのexeを使用
-        const scriptPath = path.join(__dirname, 'dutyAssign.py');
-        const venvPython = path.join(__dirname, '.venv', 'Scripts', 'python.exe');
-        const packagedExe = path.join(process.resourcesPath, 'app', 'dutyAssign.exe');
-
-        const command = isDev ? venvPython : packagedExe;
-        const args = isDev ? [scriptPath, filePath] : [filePath];
-        const pythonProcess = spawn(command, args, { encoding: 'utf8' });
-        
-        return new Promise((resolve) => {
-            let result = '';
-            let error = '';
-    
-            // spawn自体が失敗した場合のエラーハンドリング (例: コマンドが見つからない)
-            pythonProcess.on('error', (err) => {
-                resolve({ success: false, message: `Failed to start Python script: ${err.message}` });
-            });
-
-            // Pythonからの標準出力を受け取る
-            pythonProcess.stdout.on('data', (data) => {
-                result += data.toString();
-            });
-    
-            // Pythonからの標準エラー出力を受け取る
-            pythonProcess.stderr.on('data', (data) => {
-                error += data.toString();
-            });
-    
-            // プロセスの終了を待つ
-            pythonProcess.on('close', (code) => {
-                if (code !== 0) {
-                    resolve({ success: false, message: `Python script exited with code ${code}: ${error}` });
-                } else {
-                    resolve({ success: true, message: result });
-                }
-            });
+    // 常駐しているPythonワーカーに処理を依頼する（2回目以降はライブラリの読み込み時間がかからない）
+    // options.solver_profile でソルバーの設定の組（draft / balanced / optimal）を選べる
+    ipcMain.handle('run-python-script', async (event, filePath, options = {}) => {
+        // レンダラープロセスから受け取るのは設定の組の名前だけにする
+        const workerOptions = options.solver_profile ? { solver_profile: String(options.solver_profile) } : {};
+        // 途中経過はレンダラープロセスに 'python-progress' イベントとして送る
+        return runInPythonWorker(filePath, workerOptions, (progress) => {
+            if (!event.sender.isDestroyed()) {
+                event.sender.send('python-progress', progress);
+            }
         });
     });
 
+    // レンダラープロセスからの探索の停止要求
+    ipcMain.handle('stop-python-script', () => {
+        stopPythonWorkerSearch();
+    });
+
+    // 起動直後にワーカーを立ち上げておき、1回目の実行も待ち時間を減らす
+    getPythonWorker();
+
     // ファイル選択ダイアログを開くためのIPCハンドラを追加
     ipcMain.handle('open-file-dialog', async () => {
         const { canceled, filePaths } = await dialog.showOpenDialog({
@@ -104,6 +198,14 @@ app.whenReady().then(() => {
     });
 });
 
+// アプリ終了時にワーカーも終了させる
+app.on('will-quit', () => {
+    if (pythonWorker) {
+        pythonWorker.kill();
+        pythonWorker = null;
+    }
+});
+
 app.on('window-all-closed', () => {
     if (process.platform !== 'darwin') {
         app.quit();
@@ -2,7 +2,9 @@ const { contextBridge, ipcRenderer } = require('electron');
 
 contextBridge.exposeInMainWorld('api', {
     readClipboard: () => ipcRenderer.invoke('read-clipboard'),
-    runPythonScript: (filePath) => ipcRenderer.invoke('run-python-script', filePath),
+    runPythonScript: (filePath, options) => ipcRenderer.invoke('run-python-script', filePath, options),
+    stopPythonScript: () => ipcRenderer.invoke('stop-python-script'),
+    onPythonProgress: (callback) => ipcRenderer.on('python-progress', (event, progress) => callback(progress)),
     openFileDialog: () => ipcRenderer.invoke('open-file-dialog'),
     showMessageBox: (options) => ipcRenderer.invoke('show-message-box', options)
 });
\ No newline at end of file
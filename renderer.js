@@ -1,5 +1,19 @@
 const tableContainer = document.getElementById('table-container');
 const openFileButton = document.getElementById('open-file-button');
+const stopButton = document.getElementById('stop-button');
+const solverProfileSelect = document.getElementById('solver-profile');
+
+// 改善解が見つかるたびに途中経過を表示する
+window.api.onPythonProgress((progress) => {
+    tableContainer.textContent =
+        `${progress.stage}段目 / 〇を採用した人数: ${progress.num_people_assigned}人 / 〇の採用スコア: ${progress.preference_score} / 経過時間: ${progress.elapsed.toFixed(1)}秒`;
+});
+
+// 中断ボタン: 探索を打ち切り、それまでの最良の勤務表を保存させる
+stopButton.addEventListener('click', async () => {
+    stopButton.disabled = true;
+    await window.api.stopPythonScript();
+});
 
 // Pythonスクリプトを実行し、結果を通知する関数
 async function executePythonScript(filePath) {
@@ -9,7 +23,18 @@ async function executePythonScript(filePath) {
     }
     console.log('Pythonスクリプトの実行対象ファイルパス:', filePath);
     // メインプロセスにPythonスクリプトの実行を依頼し、結果を受け取る
-    const result = await window.api.runPythonScript(filePath);
+    tableContainer.textContent = '計算中...';
+    openFileButton.disabled = true;
+    solverProfileSelect.disabled = true;
+    stopButton.disabled = false;
+    let result;
+    try {
+        result = await window.api.runPythonScript(filePath, { solver_profile: solverProfileSelect.value });
+    } finally {
+        openFileButton.disabled = false;
+        solverProfileSelect.disabled = false;
+        stopButton.disabled = true;
+    }
     console.log('Python script result:', result);
     // 結果をネイティブのダイアログで表示
     if (result.success) {
@@ -0,0 +1,148 @@
+"""
+ソルバーのパラメータの調整用ハーネス
+
+勤務希望ファイルの集まり（コーパス）を、探索スレッド数・探索方法（LNSのみ／既定のポートフォリオ）・
+制限時間・乱数シードの組み合わせごとに create_schedule で解き、
+最初の解までの時間・最良解までの時間・最終的なギャップ（目的関数値と上限の差の割合）をCSV/JSONで出力する。
+組み合わせごとの平均も表示するので、SOLVER_PROFILES の既定値を計測にもとづいて選べる。
+
+使い方:
+    python benchmark.py --people 30 40 --days 62 --ng-density 0.5 --maru-density 0.1 --work-dir corpus
+    python tune.py corpus/ input.xlsx --workers 1 8 --search lns portfolio --time-limits 30 --seeds 0 1 2
+"""
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import json
+import statistics
+import time
+
+import dutyAssign
+
+# 探索方法の名前 -> CpSolverのパラメータ
+SEARCH_MODES = {
+    "lns": {"use_lns_only": True},
+    "portfolio": {"use_lns_only": False},
+}
+
+# 結果ファイルの列
+RESULT_FIELDS = [
+    "file", "workers", "search", "time_limit", "seed",
+    "status", "num_people_assigned", "preference_score",
+    "first_solution_seconds", "best_solution_seconds", "gap", "solve_seconds",
+]
+
+def stage_timings(stats):
+    """create_scheduleのstatsから、求解開始から最初の解・最良解までの時間（秒）と、最後の段のギャップを求める
+
+    段ごとの時間は各段の開始からの時間なので、前の段（1段目の前に最初の解を求める探索を含む）の所要時間を足して
+    求解開始からの時間にする。最初の解を求める探索で解が見つかれば、それを最初の解として数える。
+    ギャップは (上限 - 目的関数値) / max(|上限|, 1)。最適性が証明されていれば0、解が無ければNone。
+    """
+    first_solution = None
+    best_solution = None
+    gap = None
+    offset = 0.0
+    for stage in stats.get("stages", []):
+        if stage.get("seed_first_solution_seconds") is not None:
+            first_solution = best_solution = offset + stage["seed_first_solution_seconds"]
+        offset += stage.get("seed_seconds", 0.0)
+        if stage.get("first_solution_seconds") is not None:
+            if first_solution is None:
+                first_solution = offset + stage["first_solution_seconds"]
+            best_solution = offset + stage["last_solution_seconds"]
+            if stage["status"] == "OPTIMAL":
+                gap = 0.0
+            else:
+                bound = stage["best_objective_bound"]
+                gap = (bound - stage["objective"]) / max(abs(bound), 1.0)
+        offset += stage["seconds"]
+    return first_solution, best_solution, gap
+
+def run_tuning(files, workers_grid, search_grid, time_limits, seeds):
+    """ファイルとパラメータの組み合わせ全体で create_schedule を実行し、結果のdictのリストを返す"""
+    results = []
+    for file_path, workers, search, time_limit, seed in itertools.product(
+            files, workers_grid, search_grid, time_limits, seeds):
+        stats = {}
+        params = dict(SEARCH_MODES[search], random_seed=seed)
+        start = time.perf_counter()
+        # 毎回求解の時間を測るため、解のキャッシュは使わない
+        with contextlib.redirect_stdout(io.StringIO()):
+            dutyAssign.create_schedule(file_path, stats=stats, use_cache=False, time_limit=time_limit,
+                                       num_workers=workers, solver_params=params)
+        first_solution, best_solution, gap = stage_timings(stats)
+        row = {
+            "file": file_path, "workers": workers, "search": search, "time_limit": time_limit, "seed": seed,
+            "status": stats.get("status"), "num_people_assigned": stats.get("num_people_assigned"),
+            "preference_score": stats.get("preference_score"),
+            "first_solution_seconds": first_solution, "best_solution_seconds": best_solution, "gap": gap,
+            "solve_seconds": stats.get("solve_seconds", time.perf_counter() - start),
+        }
+        results.append(row)
+        print(json.dumps(row, ensure_ascii=False), flush=True)
+    return results
+
+def summarize(results):
+    """(スレッド数, 探索方法, 制限時間) ごとに、最適性を証明できた割合・各時間とギャップの平均をまとめる
+
+    解が見つからなかった実行は、最初の解・最良解までの時間を制限時間として数える。
+    """
+    groups = {}
+    for row in results:
+        groups.setdefault((row["workers"], row["search"], row["time_limit"]), []).append(row)
+    summary = []
+    for (workers, search, time_limit), rows in groups.items():
+        def mean_of(key):
+            values = [row[key] if row[key] is not None else row["solve_seconds"] for row in rows]
+            return statistics.mean(values)
+        gaps = [row["gap"] for row in rows if row["gap"] is not None]
+        summary.append({
+            "workers": workers, "search": search, "time_limit": time_limit, "runs": len(rows),
+            "optimal": sum(row["status"] == "OPTIMAL" for row in rows) / len(rows),
+            "no_solution": sum(row["first_solution_seconds"] is None for row in rows),
+            "first_solution_seconds": mean_of("first_solution_seconds"),
+            "best_solution_seconds": mean_of("best_solution_seconds"),
+            "gap": statistics.mean(gaps) if gaps else None,
+        })
+    return summary
+
+def write_results(results, output_prefix):
+    """結果をCSVとJSON（組み合わせごとのまとめを含む）に書き出す"""
+    with open(output_prefix + ".csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for row in results:
+            writer.writerow({key: row.get(key) for key in RESULT_FIELDS})
+    with open(output_prefix + ".json", "w", encoding="utf-8") as f:
+        json.dump({"runs": results, "summary": summarize(results)}, f, ensure_ascii=False, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="ソルバーのパラメータの組み合わせごとに勤務希望ファイルを解いて比べる")
+    parser.add_argument("corpus", nargs="+", help="勤務希望ファイル、フォルダ、またはglobのパターン")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8], help="CP-SATの探索スレッド数")
+    parser.add_argument("--search", nargs="+", choices=list(SEARCH_MODES), default=list(SEARCH_MODES),
+                        help="探索方法: lns（LNSのみ）, portfolio（既定のポートフォリオ）")
+    parser.add_argument("--time-limits", type=float, nargs="+", default=[30.0], help="1回の実行の制限時間（秒）")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2], help="CP-SATの乱数シード")
+    parser.add_argument("--output", default="tune_results", help="結果ファイルの出力先（拡張子なし）")
+    args = parser.parse_args()
+
+    dutyAssign.setup_logging()
+    files = dutyAssign.collect_batch_files(args.corpus)
+    if not files:
+        print("入力ファイルが見つかりませんでした。")
+        return
+    results = run_tuning(files, args.workers, args.search, args.time_limits, args.seeds)
+    write_results(results, args.output)
+    print("スレッド数, 探索方法, 制限時間: 最適性の証明率 / 解なし / 最初の解 / 最良解 / ギャップ")
+    for row in summarize(results):
+        gap = "-" if row["gap"] is None else f"{row['gap']:.4f}"
+        print(f"{row['workers']}, {row['search']}, {row['time_limit']:g}秒: {row['optimal']:.0%} / {row['no_solution']}件"
+              f" / {row['first_solution_seconds']:.2f}秒 / {row['best_solution_seconds']:.2f}秒 / {gap}")
+    print(f"結果を {args.output}.csv / {args.output}.json に保存しました。")
+
+if __name__ == "__main__":
+    main()